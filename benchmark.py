@@ -0,0 +1,446 @@
+"""
+Benchmarks for the extractor core
+Run from the project directory:
+    python benchmark.py suite --sizes 100 1000 10000
+    python benchmark.py scan-memory --blocks 5000
+    python benchmark.py locate --blocks 5000
+    python benchmark.py xlsx-reader --blocks 5000
+    python benchmark.py startup
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from openpyxl import load_workbook
+
+from extractor_core_v2 import DeclarationType, EXTRACTORS, ImportExtractor, SheetSnapshot, get_rss_mb
+from sample_generator import generate_declaration
+
+
+def get_data_file(data_dir: str, decl_type: DeclarationType, num_blocks: int, ext: str) -> str:
+    """Path of a generated declaration, generating it on first use"""
+    path = os.path.join(data_dir, f"{decl_type.value}_{num_blocks}{ext}")
+    if not os.path.exists(path):
+        generate_declaration(path, decl_type, num_blocks)
+    return path
+
+
+# ---------------------------------------------------------------------------
+# suite: per-phase time and peak memory by size and format
+# ---------------------------------------------------------------------------
+
+def run_phases(input_file: str, decl_type: DeclarationType, output_file: str) -> dict:
+    """Run load, scan+extract, extract and write once, returning seconds per phase"""
+    extractor = EXTRACTORS[decl_type](input_file)
+    times = {}
+
+    start = time.perf_counter()
+    assert extractor.load_workbook(), extractor.progress.error_message
+    times['load'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    extractor.find_data_blocks()
+    times['scan_extract'] = time.perf_counter() - start
+
+    # Extraction alone, re-run over the blocks found by the scan
+    start = time.perf_counter()
+    for block_start in extractor.data_blocks:
+        extractor.extract_block_data(block_start)
+    times['extract'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert extractor.create_output_file(output_file), extractor.progress.error_message
+    times['write'] = time.perf_counter() - start
+
+    times['items'] = len(extractor.records)
+    return times
+
+
+def measure_peak_memory(input_file: str, decl_type: DeclarationType, output_file: str) -> dict:
+    """Peak traced memory per phase in MB (separate run, tracemalloc slows everything)"""
+    extractor = EXTRACTORS[decl_type](input_file)
+    peaks = {}
+
+    tracemalloc.start()
+    try:
+        for phase, func in (
+            ('load', extractor.load_workbook),
+            ('scan_extract', extractor.find_data_blocks),
+            ('write', lambda: extractor.create_output_file(output_file)),
+        ):
+            tracemalloc.reset_peak()
+            func()
+            peaks[phase] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def bench_suite(args):
+    """Measure every phase for each declaration type, format and size"""
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="ce_bench_")
+    os.makedirs(data_dir, exist_ok=True)
+    output_file = os.path.join(data_dir, "output.xlsx")
+    results = []
+
+    print(f"Dữ liệu: {data_dir}")
+    header = (f"{'type':<7}{'fmt':<6}{'blocks':>8}{'items':>8}"
+              f"{'load':>9}{'scan+ex':>9}{'extract':>9}{'write':>9}{'total':>9}"
+              f"{'mem load':>10}{'mem scan':>10}{'mem write':>10}")
+    print(header)
+    print("-" * len(header))
+
+    for type_name in args.types:
+        decl_type = DeclarationType(type_name)
+        for ext in args.formats:
+            for num_blocks in args.sizes:
+                label = f"{type_name:<7}{ext.lstrip('.'):<6}{num_blocks:>8}"
+                try:
+                    input_file = get_data_file(data_dir, decl_type, num_blocks, ext)
+                except (ValueError, ImportError) as e:
+                    print(f"{label}  bỏ qua: {e}")
+                    continue
+
+                runs = [run_phases(input_file, decl_type, output_file) for _ in range(args.repeat)]
+                best = {phase: min(run[phase] for run in runs)
+                        for phase in ('load', 'scan_extract', 'extract', 'write')}
+                best['total'] = best['load'] + best['scan_extract'] + best['write']
+                peaks = {} if args.no_memory else measure_peak_memory(input_file, decl_type, output_file)
+
+                print(f"{label}{runs[0]['items']:>8}"
+                      f"{best['load']:>9.3f}{best['scan_extract']:>9.3f}{best['extract']:>9.3f}"
+                      f"{best['write']:>9.3f}{best['total']:>9.3f}"
+                      f"{peaks.get('load', float('nan')):>10.1f}"
+                      f"{peaks.get('scan_extract', float('nan')):>10.1f}"
+                      f"{peaks.get('write', float('nan')):>10.1f}")
+
+                results.append({
+                    'type': type_name,
+                    'format': ext.lstrip('.'),
+                    'blocks': num_blocks,
+                    'items': runs[0]['items'],
+                    'file_size': os.path.getsize(input_file),
+                    'seconds': best,
+                    'peak_mb': peaks,
+                })
+
+    print("Thời gian tính bằng giây (tốt nhất trong các lần chạy), bộ nhớ là đỉnh tracemalloc (MB)")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"✓ Đã lưu kết quả: {args.json}")
+
+
+# ---------------------------------------------------------------------------
+# scan-memory: resident memory while scanning a fully loaded workbook
+# ---------------------------------------------------------------------------
+
+def scan_with_cell_lookups(input_file: str, sheet, checkpoints: int) -> list:
+    """Scan the way get_cell_value used to: one sheet.cell() call per probe"""
+    layout = ImportExtractor.LAYOUT
+    max_row = sheet.max_row
+    step = max(1, max_row // checkpoints)
+    samples = []
+
+    for row in range(1, max_row + 1):
+        label = sheet.cell(row, layout.label_column + 1).value
+        if label and layout.block_label in str(label):
+            sheet.cell(row, layout.key_column + 1).value
+            for col in layout.columns:
+                for offset in range(layout.block_span):
+                    sheet.cell(row + offset, col + 1).value
+        if row % step == 0:
+            samples.append((f"row {row}", get_rss_mb()))
+    return samples
+
+
+def scan_with_snapshot(input_file: str, sheet, checkpoints: int) -> list:
+    """Scan the way a streaming=False extractor does: snapshot, then find_data_blocks()
+
+    The snapshot is built from the loaded sheet as load_workbook() does for
+    a full load, and blocks are found and extracted by the real scan. RSS
+    is sampled from a second thread through both, plus once after each.
+    """
+    extractor = ImportExtractor(input_file, streaming=False)
+    samples = []
+    done = threading.Event()
+    start = time.perf_counter()
+
+    def sample():
+        while not done.wait(0.005):
+            samples.append((time.perf_counter() - start, get_rss_mb()))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        extractor.snapshot = SheetSnapshot.from_worksheet(sheet, extractor.get_columns(), extractor.layout.block_span)
+        built = (time.perf_counter() - start, get_rss_mb())
+        extractor._read_block = extractor.plan.bind(extractor.snapshot)
+        assert extractor.find_data_blocks(), extractor.progress.error_message
+        scanned = (time.perf_counter() - start, get_rss_mb())
+    finally:
+        done.set()
+        sampler.join()
+
+    step = max(1, len(samples) // checkpoints)
+    timeline = samples[step - 1::step]
+    labelled = [(f"{seconds * 1000:.0f} ms", rss) for seconds, rss in timeline]
+    labelled.insert(sum(1 for seconds, _ in timeline if seconds < built[0]),
+                    (f"{built[0] * 1000:.0f} ms snapshot", built[1]))
+    labelled.append((f"{scanned[0] * 1000:.0f} ms scanned", scanned[1]))
+    return labelled
+
+
+def bench_scan_memory(args):
+    """Show resident memory through the scan of a fully loaded TKN workbook"""
+    input_file = args.input
+    if not input_file:
+        data_dir = args.data_dir or tempfile.mkdtemp(prefix="ce_bench_")
+        input_file = get_data_file(data_dir, DeclarationType.IMPORT, args.blocks, '.xlsx')
+        print(f"File TKN {args.blocks} khối: {input_file}")
+
+    scanners = {'cell': scan_with_cell_lookups, 'snapshot': scan_with_snapshot}
+
+    for mode in args.modes:
+        sheet = load_workbook(input_file, data_only=True)[ImportExtractor.LAYOUT.sheet_name]
+        cells_before = len(sheet._cells)
+        rss_before = get_rss_mb()
+
+        start = time.perf_counter()
+        samples = scanners[mode](input_file, sheet, args.checkpoints)
+        elapsed = time.perf_counter() - start
+
+        print("=" * 60)
+        print(f"Mode: {mode}")
+        print(f"  RSS after load: {rss_before:.1f} MB")
+        for label, rss in samples:
+            print(f"  {label:>18}: {rss:8.1f} MB ({rss - rss_before:+.1f})")
+        print(f"  Cells in worksheet: {cells_before} -> {len(sheet._cells)}")
+        print(f"  Scan time: {elapsed:.3f}s")
+
+        del sheet
+
+
+# ---------------------------------------------------------------------------
+# locate: stride-predicting block locator against a row-by-row scan
+# ---------------------------------------------------------------------------
+
+def bench_locate(args):
+    """Time find_data_blocks with and without stride prediction on the same snapshot"""
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="ce_bench_")
+    os.makedirs(data_dir, exist_ok=True)
+
+    for type_name in args.types:
+        decl_type = DeclarationType(type_name)
+        cls = EXTRACTORS[decl_type]
+        input_file = get_data_file(data_dir, decl_type, args.blocks, '.xlsx')
+        extractor = cls(input_file)
+        assert extractor.load_workbook(), extractor.progress.error_message
+
+        found = {}
+        for predict in (False, True):
+            extractor.PREDICT_STRIDE = predict
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                extractor.find_data_blocks()
+                best = min(best, time.perf_counter() - start)
+            metrics = extractor.progress.metrics
+            found[predict] = (list(extractor.data_blocks), list(extractor.records))
+            mode = "stride" if predict else "full"
+            print(f"{type_name:<7}{mode:<7}{best:>9.4f}s  rows tested {metrics.rows_scanned:>9}"
+                  f"  jumped {metrics.rows_jumped:>9}  cells read {metrics.cells_read:>9}"
+                  f"  fallbacks {metrics.locator_fallbacks}")
+
+        print(f"{type_name:<7}same result: {found[True] == found[False]}")
+
+
+# ---------------------------------------------------------------------------
+# xlsx-reader: raw XML streaming reader against openpyxl read-only mode
+# ---------------------------------------------------------------------------
+
+# Values a declaration may carry in formatted cells, with their number format
+STYLED_VALUES = [
+    (datetime(2024, 1, 2), "dd/mm/yyyy"),
+    (datetime(2024, 1, 2, 13, 45), "yyyy-mm-dd hh:mm"),
+    (timedelta(hours=30, minutes=15), "[h]:mm:ss"),
+    (1234.5, "#,##0.00"),
+    (45000, "0"),
+]
+
+
+def styled_copy(input_file: str, data_dir: str, layout) -> str:
+    """Copy of an .xlsx with date, duration and number formatted rows appended in the read columns"""
+    stem = os.path.splitext(os.path.basename(input_file))[0]
+    path = os.path.join(data_dir, f"{stem}_styled.xlsx")
+    if not os.path.exists(path):
+        workbook = load_workbook(input_file)
+        sheet = workbook[layout.sheet_name]
+        for value, number_format in STYLED_VALUES:
+            row = sheet.max_row + 1
+            for col in layout.columns:
+                cell = sheet.cell(row=row, column=col + 1, value=value)
+                cell.number_format = number_format
+        workbook.save(path)
+    return path
+
+
+def same_snapshots(a: SheetSnapshot, b: SheetSnapshot) -> bool:
+    """Same rows, values and value types in every column of b"""
+    return a.nrows == b.nrows and all(
+        a[col] == values and all(type(x) is type(y) for x, y in zip(a[col], values))
+        for col, values in b.columns.items()
+    )
+
+
+def bench_xlsx_reader(args):
+    """Time and peak memory of load_workbook on .xlsx with each reader, and compare the snapshots"""
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="ce_bench_")
+    os.makedirs(data_dir, exist_ok=True)
+
+    for type_name in args.types:
+        decl_type = DeclarationType(type_name)
+        cls = EXTRACTORS[decl_type]
+        input_file = args.input or get_data_file(data_dir, decl_type, args.blocks, '.xlsx')
+
+        snapshots = {}
+        for raw in (False, True):
+            best = float('inf')
+            for _ in range(args.repeat):
+                extractor = cls(input_file)
+                extractor.RAW_XLSX = raw
+                start = time.perf_counter()
+                assert extractor.load_workbook(), extractor.progress.error_message
+                best = min(best, time.perf_counter() - start)
+            snapshots[raw] = extractor.snapshot
+
+            extractor = cls(input_file)
+            extractor.RAW_XLSX = raw
+            tracemalloc.start()
+            extractor.load_workbook()
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+
+            mode = "raw" if raw else "openpyxl"
+            print(f"{type_name:<7}{mode:<9}{best:>9.3f}s  peak {peak:>7.1f} MB"
+                  f"  rows {extractor.snapshot.nrows:>8}")
+
+        print(f"{type_name:<7}same values: {same_snapshots(snapshots[True], snapshots[False])}")
+
+        # Generated declarations hold only text and plain numbers: compare
+        # the readers on date and duration formatted cells as well
+        styled_file = styled_copy(input_file, data_dir, cls.LAYOUT)
+        for raw in (False, True):
+            extractor = cls(styled_file)
+            extractor.RAW_XLSX = raw
+            assert extractor.load_workbook(), extractor.progress.error_message
+            snapshots[raw] = extractor.snapshot
+        print(f"{type_name:<7}same values, formatted cells: {same_snapshots(snapshots[True], snapshots[False])}")
+
+
+# ---------------------------------------------------------------------------
+# startup: cold start of the core and time to first GUI window
+# ---------------------------------------------------------------------------
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP_CASES = [
+    ("import core (lazy Excel libs)", "import extractor_core_v2"),
+    ("import core + warm_up()", "import extractor_core_v2; extractor_core_v2.warm_up()"),
+    ("import core + Excel libs (eager)",
+     "import xlrd, openpyxl, openpyxl.styles, openpyxl.cell; import extractor_core_v2"),
+]
+
+
+def time_process(command: list, wait_for: str = "") -> float:
+    """Wall time of a fresh interpreter, until it exits or prints wait_for"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=PROJECT_DIR, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True)
+    if wait_for:
+        for line in proc.stdout:
+            if line.strip() == wait_for:
+                break
+        elapsed = time.perf_counter() - start
+        proc.communicate()
+    else:
+        proc.communicate()
+        elapsed = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(f"exit code {proc.returncode}")
+    return elapsed
+
+
+def bench_startup(args):
+    """Median cold-start times over fresh interpreters"""
+    cases = [(label, [sys.executable, "-c", code], "") for label, code in STARTUP_CASES]
+    cases.append(("GUI first window", [sys.executable, "customs_extractor_gui_v2.py", "--startup-check"], "ready"))
+
+    for label, command, wait_for in cases:
+        try:
+            times = [time_process(command, wait_for) for _ in range(args.repeat)]
+        except (RuntimeError, OSError) as e:
+            # No customtkinter or no display for the GUI case
+            print(f"{label:<36} bỏ qua: {e}")
+            continue
+        print(f"{label:<36}{statistics.median(times):>9.3f}s  (tốt nhất {min(times):.3f}s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Customs Extractor benchmarks")
+    parser.add_argument("--data-dir", default="",
+                        help="Folder for generated declarations, reused between runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    suite = subparsers.add_parser("suite", help="Time and peak memory per phase, size and format")
+    suite.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    suite.add_argument("--formats", nargs="+", choices=[".xls", ".xlsx"], default=[".xlsx", ".xls"])
+    suite.add_argument("--types", nargs="+", choices=[t.value for t in DeclarationType],
+                       default=[t.value for t in DeclarationType])
+    suite.add_argument("--repeat", type=int, default=3, help="Runs per case, the best time is kept")
+    suite.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run")
+    suite.add_argument("--json", help="Also write the results to this JSON file")
+    suite.set_defaults(func=bench_suite)
+
+    scan = subparsers.add_parser("scan-memory", help="Resident memory during the block scan")
+    scan.add_argument("--input", help="TKN .xlsx file (default: generated)")
+    scan.add_argument("--blocks", type=int, default=5000, help="Blocks in the generated file")
+    scan.add_argument("--checkpoints", type=int, default=10, help="RSS samples during the scan")
+    scan.add_argument("--modes", nargs="+", choices=["cell", "snapshot"], default=["snapshot", "cell"])
+    scan.set_defaults(func=bench_scan_memory)
+
+    locate = subparsers.add_parser("locate", help="Block locator with and without stride prediction")
+    locate.add_argument("--blocks", type=int, default=5000, help="Blocks in the generated files")
+    locate.add_argument("--types", nargs="+", choices=[t.value for t in DeclarationType],
+                        default=[t.value for t in DeclarationType])
+    locate.add_argument("--repeat", type=int, default=3, help="Runs per mode, the best time is kept")
+    locate.set_defaults(func=bench_locate)
+
+    reader = subparsers.add_parser("xlsx-reader", help="Raw XML .xlsx reader against openpyxl read-only mode")
+    reader.add_argument("--input", help="TKX/TKN .xlsx file (default: generated)")
+    reader.add_argument("--blocks", type=int, default=5000, help="Blocks in the generated files")
+    reader.add_argument("--types", nargs="+", choices=[t.value for t in DeclarationType],
+                        default=[t.value for t in DeclarationType])
+    reader.add_argument("--repeat", type=int, default=3, help="Runs per reader, the best time is kept")
+    reader.set_defaults(func=bench_xlsx_reader)
+
+    startup = subparsers.add_parser("startup", help="Cold start time of the core and the GUI window")
+    startup.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per case")
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
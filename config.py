@@ -29,7 +29,10 @@ class Config:
             "recent_files": [],
             "last_input_folder": "",
             "last_output_folder": "",
-            "window_geometry": "900x700"
+            "window_geometry": "900x700",
+            "use_cache": True,
+            "cache_max_mb": 200,
+            "warm_up": True
         }
         
         self.settings = self.load()
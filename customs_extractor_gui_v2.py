@@ -8,10 +8,15 @@ from tkinter import filedialog, messagebox
 import threading
 import os
 import subprocess
+import sys
 from pathlib import Path
 from typing import Optional
 from config import Config
-from extractor_core_v2 import ExportExtractor, ImportExtractor, ExtractionProgress, DeclarationType
+from extraction_cache import ExtractionCache
+from extractor_core_v2 import (
+    ExportExtractor, ImportExtractor, Preview, ProgressSnapshot, DeclarationType, OUTPUT_SINKS,
+    detect_declaration_types, warm_up
+)
 
 # Set appearance
 ctk.set_appearance_mode("dark")
@@ -27,6 +32,14 @@ class CustomsExtractorV2(ctk.CTk):
         # Configuration
         self.config = Config()
         
+        # Set by on_closing: worker threads stop posting to the window
+        self.is_closing = False
+        
+        # Line items of unchanged files are reused across runs
+        self.cache = None
+        if self.config.get("use_cache", True):
+            self.cache = ExtractionCache(max_size_mb=self.config.get("cache_max_mb", 200))
+        
         # Window setup
         self.title("🎯 Trích xuất dữ liệu Tờ khai Hải quan - V2")
         self.geometry(self.config.get("window_geometry", "1000x750"))
@@ -40,7 +53,8 @@ class CustomsExtractorV2(ctk.CTk):
             'output_folder_var': ctk.StringVar(),
             'output_name_var': ctk.StringVar(value="DS hàng xuất"),
             'is_extracting': False,
-            'extractor': None
+            'extractor': None,
+            'thread': None
         }
         
         self.import_state = {
@@ -48,7 +62,8 @@ class CustomsExtractorV2(ctk.CTk):
             'output_folder_var': ctk.StringVar(),
             'output_name_var': ctk.StringVar(value="DS hàng nhập"),
             'is_extracting': False,
-            'extractor': None
+            'extractor': None,
+            'thread': None
         }
         
         # Shared options
@@ -61,6 +76,17 @@ class CustomsExtractorV2(ctk.CTk):
         
         # Protocol for window close
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        
+        # Load the Excel libraries in the background once the window is drawn
+        self.warm_up_seconds = None
+        if self.config.get("warm_up", True):
+            self.after_idle(self.start_warm_up)
+    
+    def start_warm_up(self):
+        """Import xlrd/openpyxl on a background thread so the first extraction starts at once"""
+        def run():
+            self.warm_up_seconds = warm_up()
+        threading.Thread(target=run, daemon=True).start()
     
     def create_widgets(self):
         """Create all UI widgets"""
@@ -82,8 +108,12 @@ class CustomsExtractorV2(ctk.CTk):
         self.tabview.pack(fill="both", expand=True, pady=10)
         
         # Add tabs
-        self.tab_export = self.tabview.add("TK Xuất khẩu")
-        self.tab_import = self.tabview.add("TK Nhập khẩu")
+        self.tab_names = {
+            DeclarationType.EXPORT: "TK Xuất khẩu",
+            DeclarationType.IMPORT: "TK Nhập khẩu",
+        }
+        self.tab_export = self.tabview.add(self.tab_names[DeclarationType.EXPORT])
+        self.tab_import = self.tabview.add(self.tab_names[DeclarationType.IMPORT])
         
         # Build each tab
         self.build_export_tab()
@@ -186,7 +216,19 @@ class CustomsExtractorV2(ctk.CTk):
             font=ctk.CTkFont(size=14, weight="bold"),
             height=40
         )
-        self.export_state['extract_btn'].pack(fill="x", padx=10, pady=10)
+        self.export_state['extract_btn'].pack(fill="x", padx=10, pady=(10, 5))
+        
+        # Cancel button, enabled while extracting
+        self.export_state['cancel_btn'] = ctk.CTkButton(
+            tab,
+            text="✖ Hủy",
+            command=lambda: self.cancel_extraction(DeclarationType.EXPORT),
+            fg_color="gray40",
+            hover_color="#C0392B",
+            state="disabled",
+            height=30
+        )
+        self.export_state['cancel_btn'].pack(fill="x", padx=10, pady=(0, 10))
         
         # Progress
         progress_frame = ctk.CTkFrame(tab, fg_color="transparent", border_width=2)
@@ -307,7 +349,19 @@ class CustomsExtractorV2(ctk.CTk):
             font=ctk.CTkFont(size=14, weight="bold"),
             height=40
         )
-        self.import_state['extract_btn'].pack(fill="x", padx=10, pady=10)
+        self.import_state['extract_btn'].pack(fill="x", padx=10, pady=(10, 5))
+        
+        # Cancel button, enabled while extracting
+        self.import_state['cancel_btn'] = ctk.CTkButton(
+            tab,
+            text="✖ Hủy",
+            command=lambda: self.cancel_extraction(DeclarationType.IMPORT),
+            fg_color="gray40",
+            hover_color="#C0392B",
+            state="disabled",
+            height=30
+        )
+        self.import_state['cancel_btn'].pack(fill="x", padx=10, pady=(0, 10))
         
         # Progress
         progress_frame = ctk.CTkFrame(tab, fg_color="transparent", border_width=2)
@@ -395,14 +449,40 @@ class CustomsExtractorV2(ctk.CTk):
         )
         
         if filename:
+            decl_type = self.route_input_file(filename, decl_type)
+            state = self.get_current_state(decl_type)
             state['file_var'].set(filename)
             
             folder = os.path.dirname(filename)
-            self.config.set(config_key, folder)
+            self.config.set(f"last_{decl_type.value}_folder", folder)
             
             if self.auto_update_output_var.get():
                 state['output_folder_var'].set(folder)
     
+    def route_input_file(self, filename: str, decl_type: DeclarationType) -> DeclarationType:
+        """Switch to the tab matching the sheets of the chosen file
+        
+        Stays on the current tab when its sheet is present, when the workbook
+        holds both TKX and TKN, or when the file cannot be probed.
+        """
+        try:
+            detected = detect_declaration_types(filename)
+        except Exception:
+            # load_workbook reports unreadable files when extracting
+            return decl_type
+        
+        if decl_type in detected or len(detected) != 1:
+            return decl_type
+        
+        found_type = detected[0]
+        self.tabview.set(self.tab_names[found_type])
+        self.log_message(
+            f"🔀 File có sheet {'TKX' if found_type == DeclarationType.EXPORT else 'TKN'}, "
+            f"đã chuyển sang tab {self.tab_names[found_type]}",
+            found_type
+        )
+        return found_type
+    
     def browse_output_folder(self, decl_type: DeclarationType):
         """Browse for output folder"""
         state = self.get_current_state(decl_type)
@@ -462,8 +542,9 @@ class CustomsExtractorV2(ctk.CTk):
         if not output_folder:
             output_folder = os.path.dirname(state['file_var'].get())
         
+        # Keep a known output extension (.csv, .jsonl, ...), default to .xlsx
         output_name = state['output_name_var'].get()
-        if not output_name.endswith('.xlsx'):
+        if Path(output_name).suffix.lower().lstrip('.') not in OUTPUT_SINKS:
             output_name += '.xlsx'
         
         output_path = os.path.join(output_folder, output_name)
@@ -472,50 +553,147 @@ class CustomsExtractorV2(ctk.CTk):
         if decl_type == DeclarationType.EXPORT:
             state['extractor'] = ExportExtractor(
                 state['file_var'].get(),
-                progress_callback=lambda p: self.on_progress_update(p, decl_type)
+                progress_callback=lambda p: self.on_progress_update(p, decl_type),
+                cache=self.cache
             )
         else:
             state['extractor'] = ImportExtractor(
                 state['file_var'].get(),
-                progress_callback=lambda p: self.on_progress_update(p, decl_type)
+                progress_callback=lambda p: self.on_progress_update(p, decl_type),
+                cache=self.cache
             )
         
-        # Start extraction in thread
         state['is_extracting'] = True
+        if self.show_preview_var.get():
+            # Preview first; the extraction starts once the user confirms
+            state['extract_btn'].configure(state="disabled", text="Đang xem trước...")
+            threading.Thread(
+                target=self.run_preview,
+                args=(output_path, decl_type),
+                daemon=True
+            ).start()
+        else:
+            self.launch_extraction(output_path, decl_type)
+    
+    def launch_extraction(self, output_path: str, decl_type: DeclarationType):
+        """Start the extraction thread"""
+        state = self.get_current_state(decl_type)
         state['extract_btn'].configure(state="disabled", text="Đang xử lý...")
+        state['cancel_btn'].configure(state="normal")
         
         thread = threading.Thread(
             target=self.run_extraction,
             args=(output_path, decl_type),
             daemon=True
         )
+        state['thread'] = thread
         thread.start()
     
+    def run_preview(self, output_path: str, decl_type: DeclarationType):
+        """Read the first line items in a background thread"""
+        state = self.get_current_state(decl_type)
+        
+        try:
+            preview = state['extractor'].preview()
+            if not self.is_closing:
+                self.after(0, lambda: self.show_preview_dialog(preview, output_path, decl_type))
+        except Exception as e:
+            if not self.is_closing:
+                self.after(0, lambda: self.on_extraction_error(f"Lỗi khi mở file: {e}", decl_type))
+    
+    def show_preview_dialog(self, preview: Preview, output_path: str, decl_type: DeclarationType):
+        """Show the first line items; extract on confirmation"""
+        state = self.get_current_state(decl_type)
+        
+        dialog = ctk.CTkToplevel(self)
+        dialog.title("Xem trước dữ liệu")
+        dialog.geometry("900x500")
+        dialog.transient(self)
+        dialog.grab_set()
+        
+        about = "" if preview.complete else "khoảng "
+        ctk.CTkLabel(
+            dialog,
+            text=f"👁 {len(preview.items)} dòng hàng đầu tiên / tổng {about}{preview.estimated_blocks} dòng hàng "
+                 f"({preview.seconds:.2f}s)",
+            font=ctk.CTkFont(size=13, weight="bold")
+        ).pack(anchor="w", padx=10, pady=(10, 5))
+        
+        preview_text = ctk.CTkTextbox(dialog, font=ctk.CTkFont(family="Consolas", size=12), wrap="none")
+        preview_text.pack(fill="both", expand=True, padx=10, pady=5)
+        for row in state['extractor'].get_preview_data(preview.items):
+            preview_text.insert(
+                "end",
+                f"{row['index']:>3}. {row['hs_code']:<10} {row['qty1']:>12} {row['unit1']:<5} {row['description']}\n"
+            )
+        preview_text.configure(state="disabled")
+        
+        def confirm():
+            dialog.destroy()
+            self.launch_extraction(output_path, decl_type)
+        
+        def dismiss():
+            dialog.destroy()
+            self.reset_extract_button(decl_type)
+            self.log_message("Đã bỏ qua sau khi xem trước", decl_type)
+        
+        buttons = ctk.CTkFrame(dialog, fg_color="transparent")
+        buttons.pack(fill="x", padx=10, pady=10)
+        ctk.CTkButton(buttons, text="⚡ Trích xuất", command=confirm).pack(side="right")
+        ctk.CTkButton(buttons, text="Đóng", fg_color="gray40", command=dismiss).pack(side="right", padx=(0, 10))
+        dialog.protocol("WM_DELETE_WINDOW", dismiss)
+    
+    def reset_extract_button(self, decl_type: DeclarationType):
+        """Back to the idle state after a run or a dismissed preview"""
+        state = self.get_current_state(decl_type)
+        state['is_extracting'] = False
+        state['thread'] = None
+        state['extract_btn'].configure(
+            state="normal",
+            text=f"⚡ Extract Data ({'Xuất khẩu' if decl_type == DeclarationType.EXPORT else 'Nhập khẩu'})"
+        )
+        state['cancel_btn'].configure(state="disabled")
+    
+    def cancel_extraction(self, decl_type: DeclarationType):
+        """Ask the running extraction to stop; it reports back through on_extraction_complete"""
+        state = self.get_current_state(decl_type)
+        if state['is_extracting'] and state['extractor']:
+            state['extractor'].cancel()
+            state['cancel_btn'].configure(state="disabled")
+            self.log_message("⏹ Đang hủy...", decl_type)
+    
     def run_extraction(self, output_path: str, decl_type: DeclarationType):
         """Run extraction in background thread"""
         state = self.get_current_state(decl_type)
         
         try:
             success = state['extractor'].run(output_path)
-            self.after(0, lambda: self.on_extraction_complete(success, output_path, decl_type))
+            if not self.is_closing:
+                self.after(0, lambda: self.on_extraction_complete(success, output_path, decl_type))
         except Exception as e:
-            self.after(0, lambda: self.on_extraction_error(str(e), decl_type))
+            if not self.is_closing:
+                self.after(0, lambda: self.on_extraction_error(str(e), decl_type))
     
-    def on_progress_update(self, progress: ExtractionProgress, decl_type: DeclarationType):
-        """Handle progress updates from extractor"""
+    def on_progress_update(self, progress: ProgressSnapshot, decl_type: DeclarationType):
+        """Handle progress updates from extractor (already throttled, immutable)"""
+        if self.is_closing:
+            return
         self.after(0, lambda: self._update_progress_ui(progress, decl_type))
     
-    def _update_progress_ui(self, progress: ExtractionProgress, decl_type: DeclarationType):
+    def _update_progress_ui(self, progress: ProgressSnapshot, decl_type: DeclarationType):
         """Update progress UI elements"""
         state = self.get_current_state(decl_type)
         
         state['progress_bar'].set(progress.progress_percent / 100)
         
-        if progress.status_message:
+        # Per-row messages go to the status line, milestones to the log
+        if progress.is_transient:
+            state['stats_label'].configure(text=f"📈 {progress.status_message} {progress.progress_percent}%")
+        elif progress.status_message:
             self.log_message(progress.status_message, decl_type)
         
         if progress.is_complete:
-            num_blocks = len(state['extractor'].data_blocks) if state['extractor'] else 0
+            num_blocks = state['extractor'].get_stats()['items'] if state['extractor'] else 0
             state['stats_label'].configure(
                 text=f"📊 Hoàn thành: {num_blocks} khối | 100% ✓"
             )
@@ -524,14 +702,16 @@ class CustomsExtractorV2(ctk.CTk):
         """Handle extraction completion"""
         state = self.get_current_state(decl_type)
         
-        state['is_extracting'] = False
-        state['extract_btn'].configure(
-            state="normal", 
-            text=f"⚡ Extract Data ({'Xuất khẩu' if decl_type == DeclarationType.EXPORT else 'Nhập khẩu'})"
-        )
+        self.reset_extract_button(decl_type)
         
-        if success:
+        if state['extractor'] and state['extractor'].progress.is_cancelled:
+            state['progress_bar'].set(0)
+            state['stats_label'].configure(text="⏹ Đã hủy")
+            self.log_message("⏹ Đã hủy, không tạo file kết quả", decl_type)
+        elif success:
             self.log_message(f"\n✅ THÀNH CÔNG! File đã được lưu tại:\n{output_path}", decl_type)
+            if state['extractor']:
+                self.log_message(state['extractor'].progress.metrics.format_summary(), decl_type)
             
             messagebox.showinfo("Thành công", f"✅ Trích xuất thành công!\n\nFile: {os.path.basename(output_path)}")
             
@@ -547,13 +727,7 @@ class CustomsExtractorV2(ctk.CTk):
     
     def on_extraction_error(self, error: str, decl_type: DeclarationType):
         """Handle extraction error"""
-        state = self.get_current_state(decl_type)
-        
-        state['is_extracting'] = False
-        state['extract_btn'].configure(
-            state="normal",
-            text=f"⚡ Extract Data ({'Xuất khẩu' if decl_type == DeclarationType.EXPORT else 'Nhập khẩu'})"
-        )
+        self.reset_extract_button(decl_type)
         self.log_message(f"\n❌ LỖI: {error}", decl_type)
         messagebox.showerror("Lỗi", f"Đã xảy ra lỗi:\n{error}")
     
@@ -563,12 +737,30 @@ class CustomsExtractorV2(ctk.CTk):
         self.config.set("auto_open", self.auto_open_var.get())
         self.config.set("show_preview", self.show_preview_var.get())
         self.config.set("auto_update_output", self.auto_update_output_var.get())
+        
+        # Stop running extractions so their partial output is deleted
+        self.is_closing = True
+        for state in (self.export_state, self.import_state):
+            if state['is_extracting'] and state['extractor']:
+                state['extractor'].cancel()
+        for state in (self.export_state, self.import_state):
+            if state['thread']:
+                state['thread'].join(timeout=2)
         self.destroy()
 
 
 def main():
-    """Main entry point"""
+    """Main entry point
+    
+    With --startup-check the window prints "ready" and closes as soon as it
+    is first drawn, so 'benchmark.py startup' can time the first window.
+    """
     app = CustomsExtractorV2()
+    if "--startup-check" in sys.argv:
+        def report_ready():
+            print("ready", flush=True)
+            app.destroy()
+        app.after_idle(report_ready)
     app.mainloop()
 
 
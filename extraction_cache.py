@@ -0,0 +1,128 @@
+"""
+Persistent extraction cache for Customs Extractor
+Stores extracted line items keyed by file content, so unchanged declarations
+are never parsed twice
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+DEFAULT_CACHE_DIR = Path.home() / ".customs_extractor" / "cache"
+DEFAULT_MAX_SIZE_MB = 200
+
+# Bump when the on-disk entry format changes
+CACHE_FORMAT = 2
+
+
+class ExtractionCache:
+    """Content-hash keyed cache of extracted line items with LRU size eviction
+
+    Each entry is one gzip-compressed JSON file holding the items column by
+    column. Reading an entry refreshes its modification time, and entries
+    with the oldest modification time are evicted first once the cache grows
+    past max_size_mb.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        """SHA-256 of the file content"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def make_key(self, input_file: str, extractor_name: str, layout_version: int) -> str:
+        """Build the cache key for a file, extractor type and layout version"""
+        content_hash = self.file_hash(input_file)
+        raw = f"{CACHE_FORMAT}:{extractor_name}:{layout_version}:{content_hash}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:40]
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json.gz"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached entry ({'fields': [...], 'columns': {field: [...]}, 'blocks': [...]}) or None"""
+        path = self._entry_path(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+            # Mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading cache entry {path.name}: {e}")
+            return None
+
+        return entry
+
+    def put(self, key: str, fields: List[str], columns: Dict[str, List[Any]], blocks: List[int]):
+        """Store the line items of one extraction, one list per field, then evict old entries"""
+        entry = {
+            'fields': list(fields),
+            'columns': {field: columns[field] for field in fields},
+            'blocks': blocks,
+        }
+
+        path = self._entry_path(key)
+        tmp_path = None
+        try:
+            # Write to a temp file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing cache entry {path.name}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_size_mb"""
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob('*.json.gz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                # Already evicted by another process
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove all entries"""
+        for path in self.cache_dir.glob('*.json.gz'):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def get_size_mb(self) -> float:
+        """Total size of all entries in MB"""
+        return sum(p.stat().st_size for p in self.cache_dir.glob('*.json.gz')) / 1024 / 1024
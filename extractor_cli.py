@@ -0,0 +1,369 @@
+"""
+Customs Extractor V2 - Command line / batch entry point
+Extracts many TKX/TKN files in parallel, one file per worker process
+
+Examples:
+    python extractor_cli.py --type import "D:/ToKhai/2025-12"
+    python extractor_cli.py --type export "D:/ToKhai/*.xlsx" --merge "DS hàng xuất T12.xlsx"
+    python extractor_cli.py --type import "D:/ToKhai/2025-12" --format csv
+    python extractor_cli.py --type auto "D:/ToKhai/2025-12"
+    python extractor_cli.py --layout "TKN mau moi.json" "D:/ToKhai/2025-12"
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from extractor_core_v2 import (
+    DeclarationType, EXTRACTORS, LINE_ITEM_FIELDS, MERGED_OUTPUT_COLUMNS, OUTPUT_SINKS, LayoutSpec,
+    ResultSet, detect_declaration_types, extract_file, write_output_file
+)
+
+
+EXCEL_EXTENSIONS = ('.xls', '.xlsx')
+DEFAULT_OUTPUT_SUFFIX = "DS hàng"
+
+
+def collect_input_files(patterns: List[str], recursive: bool = False,
+                        output_suffix: str = DEFAULT_OUTPUT_SUFFIX) -> List[str]:
+    """Expand folders and glob patterns into a sorted list of Excel files
+
+    Results of earlier runs ('<name> - <output_suffix>.xlsx') are skipped so
+    that re-running over the same folder does not extract its own outputs.
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            walker = Path(pattern).rglob('*') if recursive else Path(pattern).iterdir()
+            candidates = [str(p) for p in walker if p.is_file()]
+        else:
+            candidates = glob.glob(pattern, recursive=recursive)
+
+        for path in candidates:
+            name = os.path.basename(path)
+            # Skip Excel lock files (~$name.xlsx)
+            if name.startswith('~$'):
+                continue
+            if Path(path).stem.endswith(f" - {output_suffix}"):
+                continue
+            if Path(path).suffix.lower() in EXCEL_EXTENSIONS:
+                files.append(os.path.abspath(path))
+
+    # A file can match several patterns
+    return sorted(set(files))
+
+
+def get_output_path(input_file: str, output_dir: str, suffix: str, output_format: str = "xlsx",
+                    sheet_name: str = "", name: str = "") -> str:
+    """Build the per-file output path, '<name>[ <sheet_name>] - <suffix>.<ext>'
+
+    name defaults to the stem of input_file.
+    """
+    folder = output_dir or os.path.dirname(input_file)
+    extension = OUTPUT_SINKS[output_format].extension
+    name = name or Path(input_file).stem
+    stem = f"{name} {sheet_name}" if sheet_name else name
+    return os.path.join(folder, f"{stem} - {suffix}{extension}")
+
+
+def assign_output_paths(jobs: List[tuple], output_dir: str, suffix: str, output_format: str,
+                        output_sheets: Dict[tuple, str]) -> Dict[tuple, str]:
+    """Per-file output path of each job, unique across the batch
+
+    Two inputs can share a stem: 'TK.xls' next to 'TK.xlsx', or files of the
+    same name in different subfolders written to one -o folder. Colliding
+    outputs are named after the file name with its extension, and if that
+    still collides, after the folder of the file relative to the common
+    folder of all inputs, so that no job overwrites the output of another.
+
+    Raises:
+        ValueError if two jobs would still write the same file
+    """
+    folders = {os.path.dirname(input_file) for input_file, _ in jobs}
+    root = os.path.commonpath(sorted(folders)) if folders else ""
+
+    def names(input_file: str) -> List[str]:
+        relative = os.path.relpath(os.path.dirname(input_file), root) if root else os.curdir
+        in_folder = Path(input_file).name
+        if relative != os.curdir:
+            in_folder = f"{relative.replace(os.sep, ' ')} {in_folder}"
+        return [Path(input_file).stem, Path(input_file).name, in_folder]
+
+    def path_key(path: str) -> str:
+        # Windows and macOS file systems ignore case
+        return os.path.normcase(path).lower()
+
+    level = {job: 0 for job in jobs}
+    while True:
+        paths = {job: get_output_path(job[0], output_dir, suffix, output_format, output_sheets[job],
+                                      names(job[0])[level[job]]) for job in jobs}
+        owners = {}
+        for job, path in paths.items():
+            owners.setdefault(path_key(path), []).append(job)
+        clashes = [group for group in owners.values() if len(group) > 1]
+        if not clashes:
+            return paths
+        for group in clashes:
+            if any(level[job] == 2 for job in group):
+                raise ValueError(f"Nhiều file cùng ghi ra {paths[group[0]]}")
+            for job in group:
+                level[job] += 1
+
+
+def plan_jobs(input_files: List[str], decl_type: Optional[DeclarationType],
+              layout: Optional[LayoutSpec] = None) -> Tuple[list, dict]:
+    """Pair each file with the declaration type(s) to extract
+    
+    With decl_type None the type is detected from the sheet names; a
+    workbook holding both TKX and TKN gives one job per sheet. With a
+    layout spec every file gets one job of type None.
+    
+    Returns:
+        (list of (input_file, decl_type) jobs, {input_file: error} for files
+        that could not be routed)
+    """
+    if decl_type is not None or layout is not None:
+        return [(input_file, decl_type) for input_file in input_files], {}
+    
+    jobs = []
+    errors = {}
+    for input_file in input_files:
+        try:
+            detected = detect_declaration_types(input_file)
+        except Exception as e:
+            errors[input_file] = f"Lỗi khi mở file: {e}"
+            continue
+        if not detected:
+            errors[input_file] = "Không có sheet TKX hoặc TKN"
+        jobs.extend((input_file, found_type) for found_type in detected)
+    return jobs, errors
+
+
+def run_batch(input_files: List[str], decl_type: Optional[DeclarationType], output_dir: str = "",
+              merge_file: str = "", workers: int = 0, suffix: str = DEFAULT_OUTPUT_SUFFIX,
+              output_format: str = "", use_cache: bool = True, report_file: str = "",
+              profile_dir: str = "", layout: Optional[LayoutSpec] = None, shard_workers: int = 1,
+              pipelined: bool = False) -> int:
+    """Extract all files in a process pool and print per-file results and throughput
+
+    Per-file outputs use output_format (default xlsx); the merged file uses
+    output_format or, if empty, the format of its extension. With use_cache,
+    unchanged files are served from the extraction cache without parsing.
+    With decl_type None each file is routed by its sheets, see plan_jobs();
+    a layout spec replaces the built-in layouts for all files.
+    report_file receives the per-file phase timings and counters as JSON;
+    with profile_dir, each file is profiled into '<profile_dir>/<name>.prof'.
+    shard_workers > 1 splits the block scan of very large sheets over that
+    many extra processes, see BaseExtractor.find_data_blocks_sharded(); it is
+    experimental and currently slower than a serial scan.
+    pipelined overlaps reading, extraction and writing of each per-file
+    output, see BaseExtractor.run_pipelined(); it is experimental and not
+    faster than the default.
+
+    Returns:
+        Number of files that failed
+    """
+    jobs, routing_errors = plan_jobs(input_files, decl_type, layout)
+    auto_detect = decl_type is None and layout is None
+    # Files with both sheets need one output per declaration type
+    job_counts = {}
+    for input_file, _ in jobs:
+        job_counts[input_file] = job_counts.get(input_file, 0) + 1
+    
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    if layout is not None:
+        type_label = f"layout {layout.name}"
+    else:
+        type_label = decl_type.value if decl_type else "tự nhận dạng"
+    print(f"Trích xuất {len(input_files)} file ({type_label}) với {workers} tiến trình...")
+    start = time.perf_counter()
+    results = {}
+
+    for input_file, error in routing_errors.items():
+        results[(input_file, None)] = {'input_file': input_file, 'decl_type': None, 'success': False,
+                                       'error': error, 'items': 0, 'blocks': 0, 'seconds': 0.0}
+        print(f"  ✗ {os.path.basename(input_file)}: {error}")
+
+    output_sheets = {}
+    for job in jobs:
+        input_file, job_type = job
+        sheet_name = layout.sheet_name if layout else EXTRACTORS[job_type].LAYOUT.sheet_name
+        # Tell apart the outputs of a workbook holding both TKX and TKN
+        output_sheets[job] = sheet_name if job_counts[input_file] > 1 else ""
+    output_paths = {}
+    if not merge_file:
+        try:
+            output_paths = assign_output_paths(jobs, output_dir, suffix, output_format or "xlsx",
+                                               output_sheets)
+        except ValueError as e:
+            print(f"✗ {e}")
+            return len(jobs) + len(routing_errors)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for job in jobs:
+            input_file, job_type = job
+            sheet_name = layout.sheet_name if layout else EXTRACTORS[job_type].LAYOUT.sheet_name
+            profile_file = None
+            if profile_dir:
+                profile_file = os.path.join(profile_dir, f"{Path(input_file).name}.{sheet_name}.prof")
+            if merge_file:
+                future = executor.submit(extract_file, input_file, job_type, None, True,
+                                         None, use_cache, profile_file, layout, shard_workers)
+            else:
+                output_file = output_paths[job]
+                future = executor.submit(extract_file, input_file, job_type, output_file,
+                                         False, output_format or None, use_cache, profile_file, layout,
+                                         shard_workers, pipelined)
+            futures[future] = job
+
+        try:
+            for future in as_completed(futures):
+                input_file, job_type = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'input_file': input_file, 'success': False, 'error': str(e),
+                              'items': 0, 'blocks': 0, 'seconds': 0.0}
+                result['decl_type'] = job_type.value if job_type else layout.name
+                results[(input_file, job_type)] = result
+
+                name = os.path.basename(input_file)
+                if auto_detect:
+                    name = f"{name} [{EXTRACTORS[job_type].LAYOUT.sheet_name}]"
+                if result['success']:
+                    cached = " [cache]" if result.get('from_cache') else ""
+                    print(f"  ✓ {name}: {result['items']} dòng hàng ({result['seconds']:.2f}s){cached}")
+                else:
+                    print(f"  ✗ {name}: {result['error']}")
+        except KeyboardInterrupt:
+            # Queued files never start; running ones receive the Ctrl+C
+            # too and their output sinks delete the partial files
+            for future in futures:
+                future.cancel()
+            raise
+
+    # Merge in input order, not completion order
+    if merge_file:
+        merged = ResultSet(('source_file',) + LINE_ITEM_FIELDS)
+        for job in jobs:
+            result = results[job]
+            if 'records' in result:
+                merged.extend(result['records'], source_file=os.path.basename(job[0]))
+        write_output_file(merge_file, merged, columns=MERGED_OUTPUT_COLUMNS,
+                          output_format=output_format or None)
+        print(f"✓ Đã lưu file gộp: {merge_file} ({len(merged)} dòng hàng)")
+
+    elapsed = time.perf_counter() - start
+    succeeded = [r for r in results.values() if r['success']]
+    total_items = sum(r['items'] for r in succeeded)
+    failed = len(results) - len(succeeded)
+
+    print("=" * 60)
+    print(f"Thành công: {len(succeeded)}/{len(results)} tờ khai, {total_items} dòng hàng")
+    print(f"Thời gian: {elapsed:.2f}s | "
+          f"{len(input_files) / elapsed:.2f} file/s | {total_items / elapsed:.1f} dòng/s")
+
+    if report_file:
+        report = {
+            'seconds': elapsed,
+            'files': [{key: value for key, value in result.items() if key != 'records'}
+                      for result in results.values()],
+        }
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"✓ Đã lưu báo cáo thời gian: {report_file}")
+    if profile_dir:
+        print(f"✓ Đã lưu profile (.prof) vào: {profile_dir}")
+    return failed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Trích xuất danh sách hàng từ nhiều tờ khai TKX/TKN cùng lúc"
+    )
+    parser.add_argument("inputs", nargs="+", help="File, thư mục hoặc mẫu glob (*.xlsx)")
+    parser.add_argument("--type", default="", choices=[t.value for t in DeclarationType] + ["auto"],
+                        help="Loại tờ khai: export (TKX), import (TKN) hoặc auto (nhận dạng theo tên sheet)")
+    parser.add_argument("--layout", default="", metavar="FILE.json",
+                        help="Dùng layout tờ khai từ file JSON thay cho --type (mẫu tờ khai mới)")
+    parser.add_argument("-o", "--output-dir", default="",
+                        help="Thư mục lưu kết quả (mặc định: cùng thư mục với file đầu vào)")
+    parser.add_argument("--merge", default="", metavar="FILE",
+                        help="Gộp tất cả dòng hàng vào một file .xlsx thay vì mỗi file một kết quả")
+    parser.add_argument("-f", "--format", default="", choices=sorted(OUTPUT_SINKS),
+                        help="Định dạng kết quả (mặc định: xlsx, hoặc theo đuôi file --merge)")
+    parser.add_argument("-j", "--workers", type=int, default=0,
+                        help="Số tiến trình song song (mặc định: số lõi CPU)")
+    parser.add_argument("--shard-workers", type=int, default=1, metavar="N",
+                        help="(Thử nghiệm, hiện chưa nhanh hơn) Chia việc tìm khối của sheet "
+                             "rất lớn (từ 50.000 hàng) cho N tiến trình")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="(Thử nghiệm, không nhanh hơn) Đọc, trích xuất và ghi kết quả "
+                             "song song thay vì lần lượt")
+    parser.add_argument("--suffix", default=DEFAULT_OUTPUT_SUFFIX,
+                        help="Hậu tố tên file kết quả: '<tên file> - <hậu tố>.<định dạng>'")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Luôn đọc lại file Excel, không dùng kết quả đã lưu")
+    parser.add_argument("--report", default="", metavar="FILE.json",
+                        help="Lưu thời gian từng giai đoạn và bộ đếm của mỗi file ra JSON")
+    parser.add_argument("--profile", default="", metavar="DIR",
+                        help="Chạy cProfile/tracemalloc, lưu '<tên file>.prof' vào thư mục này")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Quét cả thư mục con")
+    args = parser.parse_args(argv)
+    if bool(args.type) == bool(args.layout):
+        parser.error("cần đúng một trong hai tùy chọn --type hoặc --layout")
+
+    layout = None
+    if args.layout:
+        try:
+            layout = LayoutSpec.load(args.layout)
+        except (OSError, ValueError) as e:
+            print(f"Lỗi layout: {e}")
+            return 1
+
+    input_files = collect_input_files(args.inputs, args.recursive, args.suffix)
+    if args.merge:
+        merge_path = os.path.abspath(args.merge)
+        input_files = [f for f in input_files if f != merge_path]
+    if not input_files:
+        print("Không tìm thấy file .xls/.xlsx nào!")
+        return 1
+
+    try:
+        failed = run_batch(
+            input_files,
+            DeclarationType(args.type) if args.type and args.type != "auto" else None,
+            output_dir=args.output_dir,
+            merge_file=args.merge,
+            workers=args.workers,
+            suffix=args.suffix,
+            output_format=args.format,
+            use_cache=not args.no_cache,
+            report_file=args.report,
+            profile_dir=args.profile,
+            layout=layout,
+            shard_workers=args.shard_workers,
+            pipelined=args.pipelined,
+        )
+    except KeyboardInterrupt:
+        print("\n⏹ Đã hủy. Các file kết quả đang ghi dở đã được xóa.")
+        return 130
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,28 @@
 """
 Customs Data Extractor V2 - Core Module
 Supports both Export (TKX) and Import (TKN) declarations
+
+xlrd and openpyxl are imported on first use, not with this module, so that
+the GUI window appears before the Excel libraries are loaded; see warm_up().
 """
 
-import xlrd
-from openpyxl import load_workbook, Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+import csv
+import hashlib
+import io
+import json
+import math
 import os
+import queue
 import re
+import sys
+import threading
+import time
+import tracemalloc
 from enum import Enum
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional, Callable
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Callable, Iterable, Iterator, Sequence, Tuple, NamedTuple
 from pathlib import Path
 
 
@@ -20,6 +32,1356 @@ class DeclarationType(Enum):
     IMPORT = "import"
 
 
+class LineItem(NamedTuple):
+    """One extracted line item (a block of the declaration)
+    
+    A tuple subclass: no per-instance dict, fields in a fixed order.
+    Quantities and amounts are numbers, None when the cell is empty; see
+    normalize_numbers().
+    """
+    hs_code: str
+    description: str
+    origin: str
+    qty1: Optional[float]
+    unit1: str
+    qty2: Optional[float]
+    unit2: str
+    invoice_value: Optional[float]
+    unit_price: Optional[float]
+
+
+LINE_ITEM_FIELDS = LineItem._fields
+
+# Fields holding numbers (layout type 'number'), written as numeric cells
+NUMBER_FIELDS = ('qty1', 'qty2', 'invoice_value', 'unit_price')
+
+# Short codes repeated on most items: stored once per process via sys.intern
+INTERNED_FIELDS = ('origin', 'unit1', 'unit2')
+
+
+class ResultSet:
+    """Line items held column by column, one list per field
+    
+    Extraction, preview, writers and the cache all share this container.
+    A row costs one pointer per field instead of a dict, and the interned
+    unit and origin codes are shared by every row. Iterating yields
+    LineItem tuples built on the fly; merged runs add extra columns such as
+    source_file, see extend().
+    """
+    
+    def __init__(self, fields: Sequence[str] = LINE_ITEM_FIELDS):
+        """fields: every LineItem field, plus any extra columns"""
+        self.fields = tuple(fields)
+        self.columns: Dict[str, List[str]] = {field: [] for field in self.fields}
+        self._item_columns = [self.columns[field] for field in LINE_ITEM_FIELDS]
+        self._appends = [column.append for column in self._item_columns]
+    
+    @classmethod
+    def from_columns(cls, fields: Sequence[str], columns: Dict[str, List[str]]) -> 'ResultSet':
+        """Result set over existing column lists (e.g. a cache entry)"""
+        results = cls(fields)
+        for field in results.fields:
+            values = columns[field]
+            if field in INTERNED_FIELDS:
+                values = [sys.intern(value) for value in values]
+            results.columns[field][:] = values
+        return results
+    
+    def __len__(self) -> int:
+        return len(self._item_columns[0])
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ResultSet):
+            return NotImplemented
+        return self.fields == other.fields and self.columns == other.columns
+    
+    def __iter__(self) -> Iterator[LineItem]:
+        return map(LineItem._make, zip(*self._item_columns))
+    
+    def __getitem__(self, index):
+        """LineItem at an index; a slice gives a list of LineItem"""
+        if isinstance(index, slice):
+            return [LineItem._make(values) for values in zip(*(column[index] for column in self._item_columns))]
+        return LineItem._make(column[index] for column in self._item_columns)
+    
+    def append(self, item: LineItem):
+        for append, value in zip(self._appends, item):
+            append(value)
+    
+    def extend(self, other: 'ResultSet', **constants: str):
+        """Append the rows of another result set
+        
+        Args:
+            other: Rows to append
+            constants: Value of extra columns for all of these rows, e.g.
+                source_file='TKN 12.xlsx'; the same string object is shared
+        """
+        count = len(other)
+        for field in self.fields:
+            if field in constants:
+                self.columns[field].extend([constants[field]] * count)
+            elif field in other.columns:
+                self.columns[field].extend(other.columns[field])
+            else:
+                self.columns[field].extend([""] * count)
+    
+    def convert_column(self, field: str, convert: Callable[[List], List]):
+        """Replace a column by convert(column), in place"""
+        self.columns[field][:] = convert(self.columns[field])
+    
+    def rows(self, keys: Sequence[str]) -> Iterator[tuple]:
+        """Rows as tuples of the given columns; unknown columns are empty"""
+        empty = [""] * len(self)
+        return zip(*(self.columns.get(key, empty) for key in keys))
+    
+    def to_dicts(self) -> List[Dict[str, str]]:
+        """Rows as plain dicts, e.g. for JSON"""
+        return [dict(zip(self.fields, values)) for values in self.rows(self.fields)]
+
+
+# Output columns: (LineItem key, header)
+OUTPUT_COLUMNS = [
+    ('description', "Mô tả hàng hóa"),
+    ('origin', "Xuất xứ"),
+    ('hs_code', "Mã số hàng hóa"),
+    ('qty1', "Số lượng (1)"),
+    ('unit1', "Đơn vị 1"),
+    ('qty2', "Số lượng (2)"),
+    ('unit2', "Đơn vị 2"),
+    ('unit_price', "Đơn giá hóa đơn"),
+    ('invoice_value', "Trị giá hóa đơn"),
+]
+
+# Output column widths by LineItem key
+COLUMN_WIDTHS = {
+    'source_file': 30,
+    'description': 70,
+    'origin': 10,
+    'hs_code': 15,
+    'qty1': 15,
+    'unit1': 12,
+    'qty2': 15,
+    'unit2': 12,
+    'unit_price': 18,
+    'invoice_value': 18,
+}
+
+# Merged batch output: same columns prefixed with the source file name
+MERGED_OUTPUT_COLUMNS = [('source_file', "Tệp nguồn")] + OUTPUT_COLUMNS
+
+
+class OutputSink(ABC):
+    """Destination for extracted line items, written one row at a time
+    
+    Usage:
+        with get_output_sink("out.csv") as sink:
+            for record in records:
+                sink.write(record)
+    
+    write_row() takes the values already in column order; write_output_file()
+    feeds a ResultSet through it without building a dict per row. If the
+    with block raises (an error or a cancelled run), abort() is called
+    instead of close() and no partial file is left behind.
+    """
+    
+    # Format name and file extension
+    format_name = ""
+    extension = ""
+    
+    def __init__(self, output_file: str, columns: List[tuple] = OUTPUT_COLUMNS):
+        self.output_file = output_file
+        self.columns = columns
+        self.keys = [key for key, _ in columns]
+        self.rows_written = 0
+        # Set by sinks that write to the file before close()
+        self.file_created = False
+    
+    @abstractmethod
+    def open(self):
+        """Create the output and write the header"""
+        pass
+    
+    def write(self, record: Dict[str, any]):
+        """Write one line item given as a dict"""
+        self.write_row([record.get(key, '') for key in self.keys])
+    
+    @abstractmethod
+    def write_row(self, values: Sequence):
+        """Write one line item given as values in column order"""
+        pass
+    
+    @abstractmethod
+    def close(self):
+        """Flush and close the output"""
+        pass
+    
+    def discard(self):
+        """Release the output without finishing it"""
+        pass
+    
+    def abort(self):
+        """Give up on the output and delete the partial file, if any"""
+        try:
+            self.discard()
+        except Exception:
+            pass
+        if self.file_created and os.path.exists(self.output_file):
+            os.remove(self.output_file)
+    
+    def __enter__(self) -> 'OutputSink':
+        self.open()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class XlsxSink(OutputSink):
+    """Formatted Excel output
+    
+    The workbook is created in write-only mode: rows are streamed to disk as
+    they are appended and every cell reuses a named style registered once,
+    so time and memory per row stay constant. Nothing is on disk until close().
+    """
+    
+    format_name = "xlsx"
+    extension = ".xlsx"
+    
+    def open(self):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.utils import get_column_letter
+        
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("data")
+        header_style, data_style = self._create_styles()
+        
+        # Column widths must be set before the first row is written
+        for col_idx, key in enumerate(self.keys, 1):
+            self.sheet.column_dimensions[get_column_letter(col_idx)].width = COLUMN_WIDTHS.get(key, 15)
+        
+        # Header
+        header_cells = []
+        for _, header in self.columns:
+            cell = WriteOnlyCell(self.sheet, value=header)
+            cell.style = header_style
+            header_cells.append(cell)
+        self.sheet.append(header_cells)
+        
+        # One styled cell per column, reused for every row: write-only
+        # sheets serialize a row as soon as it is appended
+        self.row_cells = []
+        for _ in self.keys:
+            cell = WriteOnlyCell(self.sheet)
+            cell.style = data_style
+            self.row_cells.append(cell)
+    
+    def _create_styles(self) -> tuple:
+        """Register the output named styles once per workbook"""
+        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+        
+        thin = Side(style='thin')
+        border = Border(left=thin, right=thin, top=thin, bottom=thin)
+        alignment = Alignment(vertical="top", wrap_text=True)
+        
+        header_style = NamedStyle(name="ce_header")
+        header_style.font = Font(bold=True, size=11, color="FFFFFF")
+        header_style.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+        header_style.alignment = alignment
+        header_style.border = border
+        
+        data_style = NamedStyle(name="ce_data")
+        data_style.alignment = alignment
+        data_style.border = border
+        
+        self.workbook.add_named_style(header_style)
+        self.workbook.add_named_style(data_style)
+        return header_style.name, data_style.name
+    
+    def write_row(self, values: Sequence):
+        for cell, value in zip(self.row_cells, values):
+            cell.value = value
+        self.sheet.append(self.row_cells)
+        self.rows_written += 1
+    
+    def close(self):
+        self.workbook.save(self.output_file)
+    
+    def discard(self):
+        # Nothing is on disk yet but the temp file of the streamed rows
+        self.sheet.close()
+        self.sheet._writer.cleanup()
+
+
+class CsvSink(OutputSink):
+    """CSV output, UTF-8 with BOM so Excel opens Vietnamese text correctly"""
+    
+    format_name = "csv"
+    extension = ".csv"
+    
+    def open(self):
+        self.file = open(self.output_file, 'w', encoding='utf-8-sig', newline='')
+        self.file_created = True
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([header for _, header in self.columns])
+    
+    def write_row(self, values: Sequence):
+        self.writer.writerow(values)
+        self.rows_written += 1
+    
+    def close(self):
+        self.file.close()
+    
+    def discard(self):
+        self.file.close()
+
+
+class JsonlSink(OutputSink):
+    """JSON Lines output: one object per line item, keyed by LineItem field"""
+    
+    format_name = "jsonl"
+    extension = ".jsonl"
+    
+    def open(self):
+        self.file = open(self.output_file, 'w', encoding='utf-8')
+        self.file_created = True
+    
+    def write_row(self, values: Sequence):
+        item = dict(zip(self.keys, values))
+        self.file.write(json.dumps(item, ensure_ascii=False))
+        self.file.write('\n')
+        self.rows_written += 1
+    
+    def close(self):
+        self.file.close()
+    
+    def discard(self):
+        self.file.close()
+
+
+class ParquetSink(OutputSink):
+    """Columnar Parquet output (requires the optional pyarrow package)
+    
+    Rows are buffered per column and flushed as one row group every
+    ROW_GROUP_SIZE rows, so memory stays bounded on large runs.
+    
+    Number fields are float64 columns. A number cell that held text (see
+    normalize_numbers()) cannot go there, and the schema is fixed before the
+    first row group, so each number field has a '<key>_text' string column
+    next to it: it holds the text of such cells and is null otherwise.
+    """
+    
+    format_name = "parquet"
+    extension = ".parquet"
+    ROW_GROUP_SIZE = 65536
+    
+    def open(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Cần cài pyarrow để xuất Parquet: pip install pyarrow")
+        
+        self._pa = pa
+        fields = []
+        for key in self.keys:
+            if key in NUMBER_FIELDS:
+                fields += [(key, pa.float64()), (f"{key}_text", pa.string())]
+            else:
+                fields.append((key, pa.string()))
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(self.output_file, self.schema)
+        self.file_created = True
+        self.buffer = {name: [] for name in self.schema.names}
+        # (value list, text list or None for text fields) per key, in column order
+        self._appenders = [(self.buffer[key].append,
+                            self.buffer[f"{key}_text"].append if key in NUMBER_FIELDS else None)
+                           for key in self.keys]
+    
+    def write_row(self, values: Sequence):
+        for (append, append_text), value in zip(self._appenders, values):
+            if append_text is None:
+                append(value)
+            elif value is None or value == "" or isinstance(value, (int, float)):
+                append(value if value != "" else None)
+                append_text(None)
+            else:
+                append(None)
+                append_text(str(value))
+        self.rows_written += 1
+        if self.rows_written % self.ROW_GROUP_SIZE == 0:
+            self._flush()
+    
+    def _flush(self):
+        if self.buffer[self.keys[0]]:
+            table = self._pa.Table.from_pydict(self.buffer, schema=self.schema)
+            self.writer.write_table(table)
+            for values in self.buffer.values():
+                values.clear()
+    
+    def close(self):
+        self._flush()
+        self.writer.close()
+    
+    def discard(self):
+        self.writer.close()
+
+
+OUTPUT_SINKS = {sink.format_name: sink for sink in (XlsxSink, CsvSink, JsonlSink, ParquetSink)}
+
+
+def get_output_sink(output_file: str, output_format: Optional[str] = None,
+                    columns: List[tuple] = OUTPUT_COLUMNS) -> OutputSink:
+    """Create the sink for an output file
+    
+    Args:
+        output_file: Output path
+        output_format: One of OUTPUT_SINKS; by default taken from the file
+            extension, falling back to xlsx
+        columns: (key, header) pairs selecting the output columns
+    """
+    if not output_format:
+        output_format = Path(output_file).suffix.lower().lstrip('.')
+        if output_format not in OUTPUT_SINKS:
+            output_format = XlsxSink.format_name
+    
+    if output_format not in OUTPUT_SINKS:
+        raise ValueError(f"Định dạng đầu ra không hỗ trợ: {output_format}")
+    return OUTPUT_SINKS[output_format](output_file, columns)
+
+
+def write_output_file(output_file: str, records: Iterable,
+                      columns: List[tuple] = OUTPUT_COLUMNS,
+                      on_row: Optional[Callable[[int, int], None]] = None,
+                      total_rows: Optional[int] = None,
+                      output_format: Optional[str] = None):
+    """Write line items through the output sink matching the file or format
+    
+    Args:
+        output_file: Path of the file to create
+        records: Line items: a ResultSet, or one dict per row (any iterable)
+        columns: (key, header) pairs selecting the output columns
+        on_row: Called with (row number, total rows) before each row is written
+        total_rows: Row count passed to on_row when records has no len()
+        output_format: Sink format name, see get_output_sink()
+    """
+    if total_rows is None:
+        total_rows = len(records) if hasattr(records, '__len__') else 0
+    
+    with get_output_sink(output_file, output_format, columns) as sink:
+        if isinstance(records, ResultSet):
+            rows, write = records.rows(sink.keys), sink.write_row
+        else:
+            rows, write = records, sink.write
+        for idx, data in enumerate(rows, 1):
+            if on_row:
+                on_row(idx, total_rows)
+            write(data)
+
+
+class SheetSnapshot:
+    """Column-projected, in-memory copy of a declaration sheet
+    
+    Only the columns an extractor needs are kept, each as a plain list indexed
+    by 0-based row. Columns are padded past the last row so that reads of a
+    block cut off by the end of the sheet return None instead of raising.
+    """
+    
+    def __init__(self, columns: Dict[int, list], nrows: int, ncols: int = 0):
+        self.columns = columns
+        self.nrows = nrows
+        self.ncols = ncols
+    
+    def __getitem__(self, col: int) -> list:
+        return self.columns[col]
+    
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence], columns: Iterable[int], padding: int = 0) -> 'SheetSnapshot':
+        """Build a snapshot from row tuples (openpyxl iter_rows(values_only=True))"""
+        columns = sorted(set(columns))
+        data = {col: [] for col in columns}
+        appenders = [(col, data[col].append) for col in columns]
+        nrows = 0
+        ncols = 0
+        
+        for values in rows:
+            width = len(values)
+            if width > ncols:
+                ncols = width
+            for col, append in appenders:
+                append(values[col] if col < width else None)
+            nrows += 1
+        
+        for col_values in data.values():
+            col_values.extend([None] * padding)
+        return cls(data, nrows, ncols)
+    
+    @classmethod
+    def from_worksheet(cls, sheet, columns: Iterable[int], padding: int = 0) -> 'SheetSnapshot':
+        """Build a snapshot from a fully loaded openpyxl worksheet without mutating it
+        
+        Worksheet.cell() and iter_rows() create a Cell object for every empty
+        coordinate they touch, so memory grows while scanning. This reads the
+        worksheet's cell store directly and only visits cells that exist.
+        """
+        columns = set(columns)
+        nrows = sheet.max_row if sheet._cells else 0
+        ncols = sheet.max_column if sheet._cells else 0
+        data = {col: [None] * (nrows + padding) for col in columns}
+        
+        for (row, column), cell in sheet._cells.items():
+            col_values = data.get(column - 1)
+            if col_values is not None:
+                col_values[row - 1] = cell.value
+        return cls(data, nrows, ncols)
+    
+    @classmethod
+    def from_xlrd(cls, sheet, columns: Iterable[int], padding: int = 0) -> 'SheetSnapshot':
+        """Build a snapshot from an xlrd sheet, one column at a time"""
+        data = {}
+        for col in set(columns):
+            if col < sheet.ncols:
+                col_values = sheet.col_values(col)
+            else:
+                col_values = [None] * sheet.nrows
+            col_values.extend([None] * padding)
+            data[col] = col_values
+        return cls(data, sheet.nrows, sheet.ncols)
+
+
+class XlsxSheetReader:
+    """Streaming reader of one .xlsx sheet, parsed straight from the zip
+    
+    Yields rows like openpyxl's iter_rows(values_only=True), limited to the
+    first columns, without building a workbook: opening reads only the sheet
+    directory, the sheet XML is parsed as rows are taken, and shared strings
+    only as far as the highest index used so far. A caller that stops early
+    touches only the start of the file. Cell formats are read from
+    styles.xml on the first number with a style, so that numbers shown as
+    dates or durations come back as datetime/timedelta like in openpyxl.
+    """
+    
+    def __init__(self, input_file: str, sheet_name: str):
+        import zipfile
+        
+        self.archive = zipfile.ZipFile(input_file)
+        try:
+            self.sheet_path, self.strings_path, self.styles_path, date1904 = self._find_parts(sheet_name)
+        except Exception:
+            self.archive.close()
+            raise
+        self.sheet_size = self.archive.getinfo(self.sheet_path).file_size
+        # Last row from the <dimension> element, if the sheet has one
+        self.dimension_rows: Optional[int] = None
+        self.dimension_columns: Optional[int] = None
+        self._stream = None
+        self._strings: List[str] = []
+        self._string_events = None
+        self._date1904 = date1904
+        # Cell format indexes (the s attribute) showing dates and durations, read on first use
+        self._date_styles: Optional[set] = None
+        self._duration_styles: Optional[set] = None
+    
+    @staticmethod
+    def _local(tag: str) -> str:
+        return tag.rsplit('}', 1)[-1]
+    
+    @classmethod
+    def _text_content(cls, elem) -> str:
+        """Text of a shared or inline string: runs of rich text count, phonetic hints (rPh) do not"""
+        local = cls._local
+        parts = []
+        for child in elem:
+            child_tag = local(child.tag)
+            if child_tag == 't':
+                parts.append(child.text or "")
+            elif child_tag == 'r':
+                parts.extend(t.text or "" for t in child if local(t.tag) == 't')
+        return "".join(parts)
+    
+    def _find_parts(self, sheet_name: str) -> Tuple[str, Optional[str], Optional[str], bool]:
+        """Zip paths of the sheet, the shared strings table and the styles, and the 1904 date flag"""
+        import posixpath
+        from xml.etree import ElementTree
+        
+        local = self._local
+        workbook = ElementTree.fromstring(self.archive.read('xl/workbook.xml'))
+        rel_id = None
+        date1904 = False
+        for elem in workbook.iter():
+            tag = local(elem.tag)
+            if tag == 'sheet' and elem.get('name') == sheet_name:
+                rel_id = next(value for key, value in elem.attrib.items() if local(key) == 'id')
+            elif tag == 'workbookPr':
+                date1904 = elem.get('date1904', '').lower() in ('1', 'true')
+        if rel_id is None:
+            raise KeyError(f"Không có sheet {sheet_name}")
+        
+        sheet_path = strings_path = styles_path = None
+        rels = ElementTree.fromstring(self.archive.read('xl/_rels/workbook.xml.rels'))
+        for elem in rels.iter():
+            target = elem.get('Target')
+            if not target:
+                continue
+            path = target.lstrip('/') if target.startswith('/') else posixpath.normpath('xl/' + target)
+            if elem.get('Id') == rel_id:
+                sheet_path = path
+            elif elem.get('Type', '').endswith('/sharedStrings'):
+                strings_path = path
+            elif elem.get('Type', '').endswith('/styles'):
+                styles_path = path
+        if sheet_path is None:
+            raise KeyError(f"Không tìm thấy dữ liệu của sheet {sheet_name}")
+        return sheet_path, strings_path, styles_path, date1904
+    
+    def _load_date_styles(self):
+        """Find the cell formats whose number format is a date or a duration
+        
+        Same test as openpyxl's stylesheet: custom formats by their code,
+        the others by the built-in code of their id.
+        """
+        from xml.etree import ElementTree
+        from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+        
+        local = self._local
+        dates, durations = set(), set()
+        if self.styles_path is not None:
+            custom: Dict[int, str] = {}
+            format_ids: List[int] = []
+            for elem in ElementTree.fromstring(self.archive.read(self.styles_path)):
+                tag = local(elem.tag)
+                if tag == 'numFmts':
+                    custom.update((int(fmt.get('numFmtId')), fmt.get('formatCode')) for fmt in elem)
+                elif tag == 'cellXfs':
+                    format_ids = [int(xf.get('numFmtId', 0)) for xf in elem]
+            for idx, format_id in enumerate(format_ids):
+                code = custom[format_id] if format_id in custom else builtin_format_code(format_id)
+                if is_date_format(code):
+                    dates.add(idx)
+                if is_timedelta_format(code):
+                    durations.add(idx)
+        self._date_styles, self._duration_styles = dates, durations
+    
+    def shared_string(self, index: int) -> str:
+        """Entry of the shared strings table, parsing it up to that entry"""
+        strings = self._strings
+        if index < len(strings):
+            return strings[index]
+        
+        if self._string_events is None:
+            from xml.etree.ElementTree import iterparse
+            if self.strings_path is None:
+                raise IndexError(index)
+            self._string_events = iterparse(self.archive.open(self.strings_path), events=('end',))
+        for _, elem in self._string_events:
+            if self._local(elem.tag) != 'si':
+                continue
+            strings.append(self._text_content(elem))
+            elem.clear()
+            if index < len(strings):
+                return strings[index]
+        raise IndexError(index)
+    
+    def _open_sheet(self):
+        """iterparse over the sheet XML and its tag names, in the sheet's namespace"""
+        from xml.etree.ElementTree import iterparse
+        
+        self._stream = self.archive.open(self.sheet_path)
+        events = iterparse(self._stream, events=('start', 'end'))
+        event, root = next(events)
+        tag = root.tag
+        ns = tag[:tag.index('}') + 1] if tag.startswith('{') else ''
+        self._inline_tag, self._value_tag = ns + 'is', ns + 'v'
+        return events, ns
+    
+    def _read_dimension(self, elem):
+        ref = elem.get('ref', '').rpartition(':')[2]
+        digits = ref.lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+        if digits.isdigit():
+            self.dimension_rows = int(digits)
+            self.dimension_columns = column_index(ref[:-len(digits)]) + 1 if digits != ref else None
+    
+    def cell_value(self, cell):
+        """Value of a <c> element, decoded the way openpyxl does with data_only"""
+        cell_type = cell.get('t')
+        if cell_type == 'inlineStr':
+            inline = cell.find(self._inline_tag)
+            return self._text_content(inline) if inline is not None else None
+        text = cell.findtext(self._value_tag)
+        if not text:
+            return None
+        if cell_type is None or cell_type == 'n':
+            number = float(text) if '.' in text or 'E' in text or 'e' in text else int(text)
+            style = cell.get('s')
+            if style is None:
+                return number
+            if self._date_styles is None:
+                self._load_date_styles()
+            style = int(style)
+            if style not in self._date_styles:
+                return number
+            from openpyxl.utils.datetime import MAC_EPOCH, WINDOWS_EPOCH, from_excel
+            try:
+                return from_excel(number, MAC_EPOCH if self._date1904 else WINDOWS_EPOCH,
+                                  timedelta=style in self._duration_styles)
+            except (OverflowError, ValueError):
+                # openpyxl turns dates out of range into this error value
+                return "#VALUE!"
+        if cell_type == 's':
+            return self.shared_string(int(text))
+        if cell_type == 'b':
+            return text == '1'
+        if cell_type == 'd':
+            from openpyxl.utils.datetime import from_ISO8601
+            return from_ISO8601(text)
+        return text
+    
+    def stream_columns(self, columns: Iterable[int], padding: int = 0) -> Tuple[SheetSnapshot, Iterator[int]]:
+        """Snapshot of the given columns and an iterator filling it from the sheet XML
+        
+        The iterator makes one pass over the sheet and yields the 0-based
+        index of each row once the row is complete. Cells are matched on the
+        letters of their reference and only cells of the wanted columns are
+        decoded, so shared strings are resolved only for those; no row list
+        is built. Column lists only grow, but a list stays shorter than the
+        row count until a later cell of that column (or the end) fills the
+        gap. When the iterator is exhausted the snapshot has its nrows,
+        ncols and padding, like one from read_columns().
+        """
+        snapshot = SheetSnapshot({col: [] for col in set(columns)}, 0)
+        return snapshot, self._fill_columns(snapshot, padding)
+    
+    def _fill_columns(self, snapshot: SheetSnapshot, padding: int) -> Iterator[int]:
+        events, ns = self._open_sheet()
+        row_tag, cell_tag, data_tag, dimension_tag = ns + 'row', ns + 'c', ns + 'sheetData', ns + 'dimension'
+        cell_value = self.cell_value
+        data = snapshot.columns
+        # Column index by reference letters, filled as letters are met
+        letter_columns: Dict[str, int] = {}
+        sheet_data = None
+        row_idx = -1
+        col = 0
+        ncols = 0
+        
+        for event, elem in events:
+            tag = elem.tag
+            if event == 'start':
+                if tag == row_tag:
+                    r = elem.get('r')
+                    row_idx = int(r) - 1 if r else row_idx + 1
+                    col = 0
+                elif tag == data_tag:
+                    sheet_data = elem
+                continue
+            
+            if tag == cell_tag:
+                ref = elem.get('r')
+                if ref:
+                    letters = ref.rstrip('0123456789')
+                    col = letter_columns.get(letters)
+                    if col is None:
+                        col = letter_columns[letters] = column_index(letters)
+                values = data.get(col)
+                if values is not None:
+                    missing = row_idx - len(values)
+                    if missing > 0:
+                        values.extend([None] * missing)
+                    values.append(cell_value(elem))
+                col += 1
+                if col > ncols:
+                    ncols = col
+            elif tag == row_tag:
+                # Keep memory flat: drop finished rows from the tree
+                sheet_data.clear()
+                yield row_idx
+            elif tag == dimension_tag:
+                self._read_dimension(elem)
+        
+        # Like openpyxl, trailing empty rows and columns inside the dimension count
+        snapshot.nrows = max(row_idx + 1, self.dimension_rows or 0)
+        snapshot.ncols = max(ncols, self.dimension_columns or 0)
+        for values in data.values():
+            values.extend([None] * (snapshot.nrows + padding - len(values)))
+    
+    def read_columns(self, columns: Iterable[int], padding: int = 0,
+                     check: Optional[Callable[[], None]] = None,
+                     on_row: Optional[Callable[[SheetSnapshot, int], None]] = None) -> SheetSnapshot:
+        """Snapshot of the given columns, in one pass over the sheet XML
+        
+        check, if given, is called every 256 rows (e.g. to cancel); on_row
+        with the snapshot being filled and the index of each complete row,
+        see stream_columns().
+        """
+        snapshot, rows = self.stream_columns(columns, padding)
+        for count, row in enumerate(rows):
+            if check is not None and not count & 255:
+                check()
+            if on_row is not None:
+                on_row(snapshot, row)
+        return snapshot
+    
+    def iter_rows(self, width: int) -> Iterator[Sequence]:
+        """Values of columns [0, width) of each row, from the first row on
+        
+        Rows absent from the XML (entirely empty) come as empty tuples, so
+        the position in the iteration is the 0-based row index. Built on
+        stream_columns(), so the rows read so far stay in memory: meant for
+        reading the start of a sheet, read_columns() loads a whole one.
+        """
+        snapshot, rows = self.stream_columns(range(width))
+        columns = [snapshot[col] for col in range(width)]
+        next_row = 0
+        for row in rows:
+            while next_row < row:
+                yield ()
+                next_row += 1
+            yield [values[row] if row < len(values) else None for values in columns]
+            next_row = row + 1
+    
+    def fraction_read(self) -> float:
+        """Share of the sheet XML consumed so far, 0-1"""
+        if self._stream is None or not self.sheet_size:
+            return 0.0
+        return min(1.0, self._stream.tell() / self.sheet_size)
+    
+    def close(self):
+        self.archive.close()
+    
+    def __enter__(self) -> 'XlsxSheetReader':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def column_index(ref) -> int:
+    """0-based column index from a letter reference ('F', 'AE') or an int"""
+    if isinstance(ref, int) and not isinstance(ref, bool):
+        if ref < 0:
+            raise ValueError(f"Cột không hợp lệ: {ref!r}")
+        return ref
+    if not isinstance(ref, str):
+        raise ValueError(f"Cột không hợp lệ: {ref!r}")
+    index = 0
+    for char in ref.strip().upper():
+        if not 'A' <= char <= 'Z':
+            raise ValueError(f"Cột không hợp lệ: {ref!r}")
+        index = index * 26 + ord(char) - ord('A') + 1
+    if index == 0:
+        raise ValueError(f"Cột không hợp lệ: {ref!r}")
+    return index - 1
+
+
+def column_letter(index: int) -> str:
+    """Letter reference of a 0-based column index"""
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+# How a field's raw cell value is converted, see BaseExtractor.get_converters()
+FIELD_TYPES = ('code', 'text', 'number')
+
+
+class FieldSpec(NamedTuple):
+    """Where one LineItem field sits relative to the block label row"""
+    name: str
+    column: int     # 0-based
+    offset: int     # rows below the label row
+    type: str       # one of FIELD_TYPES
+
+
+class LayoutSpec(NamedTuple):
+    """Declarative description of a declaration sheet's line-item blocks
+    
+    A block starts on a row whose label column contains block_label and whose
+    hs_code field holds an 8-digit HS code. Every field is read at a fixed
+    (row offset, column) from that row. With origin_suffix, the origin is
+    taken from the '#&XX' suffix of that field instead of a cell of its own.
+    
+    Specs load from and save to JSON, with columns as letters:
+    
+        {"name": "TKX", "sheet_name": "TKX", "block_label": "Mã số hàng hóa",
+         "label_column": "C", "origin_suffix": "description",
+         "fields": {"hs_code": {"column": "F", "offset": 0, "type": "code"}, ...}}
+    """
+    name: str
+    sheet_name: str
+    block_label: str
+    label_column: int
+    fields: Tuple[FieldSpec, ...]
+    origin_suffix: str = ""
+    # Bump when a spec change alters the extracted line items
+    version: int = 1
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, any]) -> 'LayoutSpec':
+        """Build and validate a spec from its JSON form
+        
+        Raises:
+            ValueError for a missing key, a value of the wrong kind (e.g.
+            "fields": [] or null) or an invalid column, offset or spec
+        """
+        try:
+            fields = tuple(
+                FieldSpec(name, column_index(field['column']), int(field.get('offset', 0)),
+                          field.get('type', 'text'))
+                for name, field in data['fields'].items()
+            )
+            layout = cls(
+                name=data['name'],
+                sheet_name=data.get('sheet_name', data['name']),
+                block_label=data['block_label'],
+                label_column=column_index(data['label_column']),
+                fields=fields,
+                origin_suffix=data.get('origin_suffix', ''),
+                version=int(data.get('version', 1)),
+            )
+        except KeyError as e:
+            raise ValueError(f"Layout thiếu khóa {e}")
+        except (TypeError, AttributeError, ValueError) as e:
+            raise ValueError(f"Layout không hợp lệ: {e}")
+        layout.validate()
+        return layout
+    
+    @classmethod
+    def load(cls, path: str) -> 'LayoutSpec':
+        """Load a spec from a JSON file"""
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+    
+    def to_dict(self) -> Dict[str, any]:
+        """JSON form of the spec, with columns as letters"""
+        data = {
+            'name': self.name,
+            'sheet_name': self.sheet_name,
+            'block_label': self.block_label,
+            'label_column': column_letter(self.label_column),
+            'fields': {
+                field.name: {'column': column_letter(field.column), 'offset': field.offset, 'type': field.type}
+                for field in self.fields
+            },
+            'version': self.version,
+        }
+        if self.origin_suffix:
+            data['origin_suffix'] = self.origin_suffix
+        return data
+    
+    def save(self, path: str):
+        """Write the spec as a JSON file, e.g. as a template for a new form variant"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+    
+    def validate(self):
+        """Raise ValueError if the spec cannot be compiled"""
+        for key in ('name', 'sheet_name', 'block_label'):
+            if not isinstance(getattr(self, key), str) or not getattr(self, key):
+                raise ValueError(f"Layout cần {key} là chuỗi không rỗng")
+        if not isinstance(self.origin_suffix, str):
+            raise ValueError(f"origin_suffix phải là tên trường: {self.origin_suffix!r}")
+        for column in [self.label_column] + [field.column for field in self.fields]:
+            if not isinstance(column, int) or isinstance(column, bool) or column < 0:
+                raise ValueError(f"Cột không hợp lệ trong layout {self.name}: {column!r}")
+        names = [field.name for field in self.fields]
+        for field in self.fields:
+            if field.name not in LINE_ITEM_FIELDS:
+                raise ValueError(f"Trường không hợp lệ trong layout {self.name}: {field.name}")
+            if field.type not in FIELD_TYPES:
+                raise ValueError(f"Kiểu không hợp lệ cho trường {field.name}: {field.type}")
+            if (field.type == 'number') != (field.name in NUMBER_FIELDS):
+                raise ValueError(f"Trường {field.name} phải có kiểu "
+                                 f"{'number' if field.name in NUMBER_FIELDS else 'code hoặc text'}")
+            if field.offset < 0:
+                raise ValueError(f"Độ lệch hàng của trường {field.name} phải >= 0")
+        if len(set(names)) != len(names):
+            raise ValueError(f"Layout {self.name} có trường bị lặp")
+        key = dict(zip(names, self.fields)).get('hs_code')
+        if key is None or key.offset != 0:
+            raise ValueError(f"Layout {self.name} cần trường hs_code ở hàng nhãn (offset 0)")
+        if self.origin_suffix and self.origin_suffix not in names:
+            raise ValueError(f"origin_suffix trỏ tới trường không có: {self.origin_suffix}")
+    
+    @property
+    def key_column(self) -> int:
+        """Column of the HS code on the label row"""
+        return next(field.column for field in self.fields if field.name == 'hs_code')
+    
+    @property
+    def columns(self) -> List[int]:
+        """0-based columns read by the scan and the fields"""
+        return sorted({self.label_column} | {field.column for field in self.fields})
+    
+    @property
+    def block_span(self) -> int:
+        """Rows a block spans, starting at the label row"""
+        return max(field.offset for field in self.fields) + 1
+    
+    @property
+    def fingerprint(self) -> str:
+        """Short hash of the spec, part of cache keys"""
+        raw = json.dumps(self.to_dict(), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+    
+    def compile(self, converters: Dict[str, Callable],
+                column_converters: Optional[Dict[str, Callable]] = None,
+                key_test: Optional[Callable[[object], bool]] = None) -> 'FetchPlan':
+        return FetchPlan(self, converters, column_converters, key_test)
+
+
+class FetchPlan:
+    """A LayoutSpec compiled into a flat list of (row offset, column) reads
+    
+    bind() resolves each column against a snapshot once; the returned reader
+    then extracts a block with one loop over plain lists, with no attribute
+    lookups or per-field branches. Field types with a column converter are
+    read raw and converted a whole column at a time by convert_columns().
+    match_block() is the test of a row as a block start, shared by every
+    scan of the layout.
+    """
+    
+    def __init__(self, layout: LayoutSpec, converters: Dict[str, Callable],
+                 column_converters: Optional[Dict[str, Callable]] = None,
+                 key_test: Optional[Callable[[object], bool]] = None):
+        self.layout = layout
+        self.block_label = layout.block_label
+        # Check of the key cell of a labelled row; without one any key passes
+        self.key_test = key_test or (lambda key: True)
+        column_converters = column_converters or {}
+        self.reads = [(field.offset, field.column) for field in layout.fields]
+        # (position in LineItem, converter or None for raw reads) per read
+        self.converters = [(LINE_ITEM_FIELDS.index(field.name),
+                            None if field.type in column_converters else converters[field.type])
+                           for field in layout.fields]
+        self.column_converters = [(field.name, column_converters[field.type])
+                                  for field in layout.fields if field.type in column_converters]
+        # Every LineItem field, in order; fields a layout lacks stay empty
+        self.template = [None if name in NUMBER_FIELDS else "" for name in LINE_ITEM_FIELDS]
+        self.interned = [LINE_ITEM_FIELDS.index(name) for name in INTERNED_FIELDS]
+    
+    def __len__(self) -> int:
+        return len(self.reads)
+    
+    def match_block(self, label, key) -> Optional[bool]:
+        """Test a row as a block start from its label and key cells
+        
+        Returns None when the label does not contain the block label, else
+        whether the key passes the key test: False is a labelled row that is
+        not a block (e.g. a repeated header).
+        """
+        if not label or self.block_label not in str(label):
+            return None
+        return self.key_test(key)
+    
+    def bind(self, snapshot: SheetSnapshot) -> Callable[[int], LineItem]:
+        """Reader extracting the block whose label is on the given 0-based row"""
+        steps = []
+        raw_steps = []
+        for (index, convert), (offset, column) in zip(self.converters, self.reads):
+            if convert is None:
+                raw_steps.append((index, snapshot[column], offset))
+            else:
+                steps.append((index, convert, snapshot[column], offset))
+        template = self.template
+        interned = self.interned
+        intern = sys.intern
+        make_item = LineItem._make
+        origin_index = LINE_ITEM_FIELDS.index('origin')
+        origin_source = LINE_ITEM_FIELDS.index(self.layout.origin_suffix) if self.layout.origin_suffix else None
+        
+        def read_block(row: int) -> LineItem:
+            item = template.copy()
+            for index, convert, values, offset in steps:
+                item[index] = convert(values[row + offset])
+            for index, values, offset in raw_steps:
+                item[index] = values[row + offset]
+            if origin_source is not None:
+                item[origin_index] = parse_origin_suffix(item[origin_source])
+            for index in interned:
+                item[index] = intern(item[index])
+            return make_item(item)
+        
+        return read_block
+    
+    def convert_columns(self, results: 'ResultSet'):
+        """Apply the column converters to the raw columns of read blocks"""
+        for name, convert in self.column_converters:
+            results.convert_column(name, convert)
+
+
+def normalize_numbers(values: Iterable) -> List:
+    """Convert a column of number cells to numbers in one pass
+    
+    - Numeric cells (xlrd returns every number as float, openpyxl int or
+      float) already hold the value and are kept, whole floats as int. They
+      are never formatted and re-parsed, so 2.86 read by xlrd stays 2.86.
+    - Text in the format of the declarations, '1.234.567,89', becomes
+      1234567.89: '.' groups thousands and ',' is the decimal mark.
+    - Empty cells become None (an empty output cell).
+    - Anything else is kept as stripped text, so no value is lost.
+    """
+    numbers = []
+    append = numbers.append
+    isfinite = math.isfinite
+    for value in values:
+        kind = type(value)
+        if kind is str:
+            text = value.strip()
+            if not text:
+                append(None)
+                continue
+            try:
+                value = float(text.replace('.', '').replace(',', '.'))
+            except ValueError:
+                append(text)
+                continue
+            if not isfinite(value):
+                # 'nan', 'inf': words, not amounts
+                append(text)
+                continue
+        elif kind is int:
+            append(value)
+            continue
+        elif kind is not float:
+            append(None if value is None else str(value).strip())
+            continue
+        append(int(value) if value.is_integer() else value)
+    return numbers
+
+
+def parse_origin_suffix(text: str) -> str:
+    """Country of origin from a trailing '#&XX' marker, or empty"""
+    if not text:
+        return ""
+    match = re.search(r'#&([A-Z]{2,})\s*$', text)
+    return match.group(1) if match else ""
+
+
+# Built-in layouts, in the same form as JSON spec files
+EXPORT_LAYOUT = LayoutSpec.from_dict({
+    'name': 'TKX',
+    'sheet_name': 'TKX',
+    'block_label': "Mã số hàng hóa",
+    'label_column': 'C',
+    # Origin is written as '#&XX' at the end of the description
+    'origin_suffix': 'description',
+    'fields': {
+        'hs_code': {'column': 'F', 'offset': 0, 'type': 'code'},
+        'description': {'column': 'F', 'offset': 1, 'type': 'text'},
+        'qty1': {'column': 'Q', 'offset': 4, 'type': 'number'},
+        'unit1': {'column': 'Y', 'offset': 4, 'type': 'text'},
+        'qty2': {'column': 'Q', 'offset': 5, 'type': 'number'},
+        'unit2': {'column': 'Y', 'offset': 5, 'type': 'text'},
+        'invoice_value': {'column': 'F', 'offset': 6, 'type': 'number'},
+        'unit_price': {'column': 'R', 'offset': 6, 'type': 'number'},
+    },
+})
+
+IMPORT_LAYOUT = LayoutSpec.from_dict({
+    'name': 'TKN',
+    'sheet_name': 'TKN',
+    'block_label': "Mã số hàng hóa",
+    'label_column': 'C',
+    'fields': {
+        'hs_code': {'column': 'G', 'offset': 0, 'type': 'code'},
+        'description': {'column': 'G', 'offset': 1, 'type': 'text'},
+        'qty1': {'column': 'V', 'offset': 4, 'type': 'number'},
+        'unit1': {'column': 'AE', 'offset': 4, 'type': 'text'},
+        'qty2': {'column': 'V', 'offset': 5, 'type': 'number'},
+        'unit2': {'column': 'AE', 'offset': 5, 'type': 'text'},
+        'invoice_value': {'column': 'I', 'offset': 6, 'type': 'number'},
+        # The unit price sits in the quantity column of the invoice row
+        'unit_price': {'column': 'V', 'offset': 6, 'type': 'number'},
+        'origin': {'column': 'X', 'offset': 11, 'type': 'text'},
+    },
+})
+
+
+def get_rss_mb() -> float:
+    """Resident memory of this process in MB (psutil if installed, else /proc), NaN if unknown"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return float('nan')
+
+
+class ExtractionMetrics:
+    """Per-phase wall time and memory plus scan counters of one extraction
+    
+    Each phase records its wall time in seconds, the process RSS at its end
+    and, while tracemalloc is tracing (profile mode), its peak traced memory.
+    """
+    
+    # Counters set by the block scan, summed over shards of a sharded scan
+    SCAN_COUNTERS = ('rows_scanned', 'cells_read', 'blocks_found', 'blocks_skipped', 'labels_rejected',
+                     'blocks_predicted', 'rows_jumped', 'locator_fallbacks')
+    
+    def __init__(self):
+        self.phases: Dict[str, Dict[str, float]] = {}
+        # Rows tested one by one; cells_read also counts the label cells of
+        # the bulk check over jumped rows
+        self.rows_scanned = 0
+        self.cells_loaded = 0
+        self.cells_read = 0
+        self.blocks_found = 0
+        self.blocks_skipped = 0
+        self.labels_rejected = 0
+        # Blocks found by the stride locator, rows it jumped over (checked in
+        # bulk only) and its fallbacks to a row-by-row scan
+        self.blocks_predicted = 0
+        self.rows_jumped = 0
+        self.locator_fallbacks = 0
+    
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block as phase name"""
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = {'seconds': time.perf_counter() - start}
+            if tracing:
+                entry['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            rss = get_rss_mb()
+            if rss == rss:
+                entry['rss_mb'] = rss
+            self.phases[name] = entry
+    
+    @property
+    def total_seconds(self) -> float:
+        return sum(entry['seconds'] for entry in self.phases.values())
+    
+    def to_dict(self) -> Dict[str, any]:
+        """Machine-readable report"""
+        return {
+            'phases': self.phases,
+            'total_seconds': self.total_seconds,
+            'rows_scanned': self.rows_scanned,
+            'cells_loaded': self.cells_loaded,
+            'cells_read': self.cells_read,
+            'blocks_found': self.blocks_found,
+            'blocks_skipped': self.blocks_skipped,
+            'labels_rejected': self.labels_rejected,
+            'blocks_predicted': self.blocks_predicted,
+            'rows_jumped': self.rows_jumped,
+            'locator_fallbacks': self.locator_fallbacks,
+        }
+    
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.to_dict(), indent=indent, ensure_ascii=False)
+    
+    def format_summary(self) -> str:
+        """One-line human-readable summary"""
+        parts = [f"{name} {entry['seconds']:.2f}s" for name, entry in self.phases.items()]
+        return f"⏱ {' | '.join(parts)} | tổng {self.total_seconds:.2f}s"
+
+
+class Preview(NamedTuple):
+    """First line items of a declaration, see BaseExtractor.preview()"""
+    items: ResultSet
+    estimated_blocks: int   # exact when complete
+    complete: bool          # the whole sheet was read
+    rows_read: int
+    seconds: float
+
+
+class ExtractionCancelled(Exception):
+    """Raised inside a run whose CancellationToken was cancelled"""
+
+
+class CancellationToken(threading.Event):
+    """Flag asking a running extraction to stop, settable from any thread
+    
+    The extractor checks it in its load, scan and write loops. After
+    cancel() the run stops at the next check, within a few milliseconds,
+    releases the workbook and deletes any partial output. Opening the
+    workbook cannot be interrupted (xlrd parsing an .xls sheet, openpyxl
+    reading the shared strings of an .xlsx); the run stops right after it.
+    """
+    
+    def cancel(self):
+        self.set()
+    
+    @property
+    def is_cancelled(self) -> bool:
+        return self.is_set()
+    
+    def raise_if_cancelled(self):
+        if self.is_set():
+            raise ExtractionCancelled()
+
+
+class ProgressSnapshot(NamedTuple):
+    """Immutable copy of the progress state, passed to progress callbacks
+    
+    Safe to hand to another thread (e.g. Tk's after()) because later updates
+    never change it. Transient snapshots carry per-row messages that are
+    superseded by the next update and need not be logged.
+    """
+    total_steps: int
+    current_step: int
+    status_message: str
+    is_complete: bool
+    has_error: bool
+    error_message: str
+    is_transient: bool = False
+    is_cancelled: bool = False
+    
+    @property
+    def progress_percent(self) -> int:
+        """Get progress as percentage (0-100)"""
+        if self.total_steps == 0:
+            return 0
+        return int((self.current_step / self.total_steps) * 100)
+
+
+class ProgressThrottle:
+    """Coalesces progress updates before they reach the callback
+    
+    Milestone updates (phase changes, completion, errors) are always passed
+    through. Transient updates are passed at most once per min_interval
+    seconds and only when the percentage has changed, so the callback rate
+    is bounded no matter how many blocks a file has.
+    """
+    
+    def __init__(self, callback: Callable[[ProgressSnapshot], None], min_interval: float = 0.1):
+        self.callback = callback
+        self.min_interval = min_interval
+        self._last_time = 0.0
+        self._last_percent = -1
+    
+    def is_due(self) -> bool:
+        """Check whether a transient update would be passed through now"""
+        return time.monotonic() - self._last_time >= self.min_interval
+    
+    def publish(self, snapshot: ProgressSnapshot):
+        """Pass a snapshot to the callback unless it is a redundant transient update"""
+        if snapshot.is_transient:
+            if not self.is_due() or snapshot.progress_percent == self._last_percent:
+                return
+        
+        self._last_time = time.monotonic()
+        self._last_percent = snapshot.progress_percent
+        self.callback(snapshot)
+
+
 class ExtractionProgress:
     """Progress tracking for extraction process"""
     
@@ -30,6 +1392,8 @@ class ExtractionProgress:
         self.is_complete = False
         self.has_error = False
         self.error_message = ""
+        self.is_cancelled = False
+        self.metrics = ExtractionMetrics()
     
     @property
     def progress_percent(self) -> int:
@@ -37,478 +1401,1131 @@ class ExtractionProgress:
         if self.total_steps == 0:
             return 0
         return int((self.current_step / self.total_steps) * 100)
+    
+    def snapshot(self, transient: bool = False) -> ProgressSnapshot:
+        """Get an immutable copy of the current state"""
+        return ProgressSnapshot(
+            self.total_steps,
+            self.current_step,
+            self.status_message,
+            self.is_complete,
+            self.has_error,
+            self.error_message,
+            transient,
+            self.is_cancelled,
+        )
 
 
 class BaseExtractor(ABC):
-    """Base class for customs declaration extractors"""
+    """Base class for customs declaration extractors
+    
+    The block layout comes from a LayoutSpec: subclasses set LAYOUT, or a
+    spec loaded from a file is passed as layout.
+    """
+    
+    LAYOUT: Optional[LayoutSpec] = None
+    
+    # Jump between blocks a learned stride apart instead of testing every row
+    PREDICT_STRIDE = True
+    
+    # Line items shown by preview()
+    PREVIEW_BLOCKS = 20
+    
+    # Stream .xlsx sheets straight from the zip (XlsxSheetReader) instead of
+    # through openpyxl's read-only mode
+    RAW_XLSX = True
+    
+    # Smallest sheet whose block scan is split into shards when shard_workers > 1
+    SHARD_MIN_ROWS = 50000
+    
+    # Pipelined run: block starts queued between reading and extraction, and
+    # line items per batch handed from extraction to the writer
+    PIPELINE_QUEUE = 1024
+    PIPELINE_BATCH = 256
     
-    @abstractmethod
     def get_sheet_name(self) -> str:
         """Get the sheet name to process"""
-        pass
+        return self.layout.sheet_name
     
-    @abstractmethod
-    def extract_block_data(self, start_row: int) -> Optional[Dict[str, any]]:
-        """Extract data from a single block"""
-        pass
+    def get_columns(self) -> List[int]:
+        """Get the 0-based columns read by this extractor"""
+        return self.layout.columns
+    
+    def get_converters(self) -> Dict[str, Callable]:
+        """Per-cell converter for each layout field type"""
+        return {
+            'code': self.format_code,
+            'text': self.format_text,
+        }
+    
+    def get_column_converters(self) -> Dict[str, Callable]:
+        """Converter of whole columns for field types read raw during the scan"""
+        return {
+            'number': normalize_numbers,
+        }
     
-    def __init__(self, input_file: str, progress_callback: Optional[Callable] = None):
-        """Initialize extractor"""
+    def __init__(self, input_file: str, progress_callback: Optional[Callable] = None,
+                 streaming: bool = True, cache=None, progress_interval: float = 0.1,
+                 profile: bool = False, layout: Optional[LayoutSpec] = None,
+                 cancel_token: Optional[CancellationToken] = None, shard_workers: int = 1,
+                 pipelined: bool = False):
+        """Initialize extractor
+        
+        Args:
+            input_file: Path to the .xls/.xlsx declaration
+            progress_callback: Called with a ProgressSnapshot on every milestone
+                and at most every progress_interval seconds in between
+            streaming: For .xlsx, read the declaration sheet in one forward
+                pass (XlsxSheetReader, or openpyxl read-only mode if RAW_XLSX
+                is off) instead of loading the whole workbook into memory
+            cache: ExtractionCache to reuse line items of unchanged files
+            progress_interval: Minimum seconds between per-row progress updates
+            profile: Run under cProfile and tracemalloc; phase metrics then
+                include peak memory and the profile is kept in self.profiler
+            layout: Block layout to use instead of the class LAYOUT
+            cancel_token: Token another thread can cancel to stop the run,
+                see cancel()
+            shard_workers: Processes for the block scan of sheets of at least
+                SHARD_MIN_ROWS rows, see find_data_blocks_sharded() (experimental,
+                currently slower than the default 1)
+            pipelined: Make run() read, extract and write at the same time,
+                see run_pipelined() (experimental, not faster than the default)
+        
+        Both formats are loaded into a SheetSnapshot holding only the columns
+        returned by get_columns(), so extraction never touches the workbook.
+        """
         self.input_file = input_file
+        self.layout = layout or self.LAYOUT
+        if self.layout is None:
+            raise ValueError("Cần một layout tờ khai (LAYOUT hoặc tham số layout)")
+        self.plan = self.layout.compile(self.get_converters(), self.get_column_converters(), self.is_hs_code)
+        self._read_block: Optional[Callable[[int], LineItem]] = None
         self.progress_callback = progress_callback
         self.progress = ExtractionProgress()
+        self._progress_throttle = ProgressThrottle(progress_callback, progress_interval) if progress_callback else None
         self.workbook = None
         self.sheet = None
+        self.snapshot: Optional[SheetSnapshot] = None
         self.data_blocks = []
         
+        # Line items extracted during the scan, shared by preview, writer and stats
+        self.records = ResultSet()
+        
         # Detect file format
         self.file_ext = Path(input_file).suffix.lower()
         self.is_xls = (self.file_ext == '.xls')
+        self.is_streaming = streaming and not self.is_xls
+        self.cache = cache
+        self.from_cache = False
+        
+        self.profile = profile
+        self.profiler = None
+        self._profiling_active = False
+        
+        self.cancel_token = cancel_token or CancellationToken()
+        self.shard_workers = shard_workers
+        self.pipelined = pipelined
     
-    def _update_progress(self, step: int, message: str):
+    def _update_progress(self, step: int, message: str, transient: bool = False):
         """Update progress and call callback"""
         self.progress.current_step = step
         self.progress.status_message = message
-        
-        if self.progress_callback:
-            self.progress_callback(self.progress)
+        self._notify_progress(transient)
     
-    def get_cell_value(self, row: int, col: int):
-        """Get cell value - works for both xlrd and openpyxl"""
-        if self.is_xls:
-            return self.sheet.cell_value(row, col)
-        else:
-            return self.sheet.cell(row, col).value
+    def _notify_progress(self, transient: bool = False):
+        """Publish a snapshot of the progress through the throttle"""
+        if self._progress_throttle:
+            self._progress_throttle.publish(self.progress.snapshot(transient))
+    
+    def _set_error(self, message: str):
+        """Mark the extraction as failed and report it"""
+        self.progress.has_error = True
+        self.progress.error_message = message
+        self._notify_progress()
     
     @staticmethod
-    def format_number(value) -> str:
-        """Format number from Vietnamese format to Excel format"""
-        if value is None or value == "":
-            return ""
+    def is_hs_code(value) -> bool:
+        """Check whether a cell value is an 8-digit HS code"""
+        if isinstance(value, (int, float)):
+            value_str = str(int(value))
+        else:
+            value_str = str(value).strip() if value else ""
+        return value_str.isdigit() and len(value_str) == 8
+    
+    def find_data_blocks(self) -> int:
+        """Find all data blocks and extract their line items
         
-        value_str = str(value).strip()
-        if not value_str:
-            return ""
+        Declarations print one line item per page and the pages have the same
+        height, so blocks sit a fixed stride apart. Rows are tested one by one
+        until three blocks in a row are equally spaced; from then on only the
+        predicted label row of the next block is tested. The rows jumped over
+        are still checked for the block label in bulk (a C-level join, no
+        per-row Python work), so the result is always that of a full scan:
+        when the bulk check hits, or the predicted row is not a valid block,
+        the locator falls back to testing every row after the last block
+        until it learns the stride again.
+        """
+        try:
+            self._update_progress(2, "Đang tìm kiếm các khối dữ liệu...")
+            self.data_blocks = []
+            self.records = ResultSet()
+            
+            labels = self.snapshot[self.layout.label_column]
+            hs_codes = self.snapshot[self.layout.key_column]
+            block_label = self.layout.block_label
+            match_block = self.plan.match_block
+            blocks = self.data_blocks
+            nrows = self.snapshot.nrows
+            predict = self.PREDICT_STRIDE
+            min_stride = self.layout.block_span
+            cancelled = self.cancel_token.is_set
+            
+            stride = 0
+            probed = 0
+            label_hits = 0
+            rejected = 0
+            predicted = 0
+            jumped = 0
+            bulk_read = 0
+            fallbacks = 0
+            row_idx = 0
+            
+            while row_idx < nrows:
+                if cancelled():
+                    raise ExtractionCancelled()
+                if stride:
+                    last = blocks[-1]
+                    target = last + stride
+                    between = labels[last + 1:target]
+                    bulk_read += len(between)
+                    skipped = "\0".join(map(str, filter(None, between)))
+                    if target < nrows and block_label not in skipped:
+                        probed += 1
+                        label = labels[target]
+                        found = match_block(label, hs_codes[target]) if label else None
+                        if found is not None:
+                            label_hits += 1
+                            if found:
+                                self._add_block(target)
+                                predicted += 1
+                                jumped += stride - 1
+                                row_idx = target + 1
+                                continue
+                    # Prediction failed or a label was jumped over: test
+                    # every row after the last block
+                    stride = 0
+                    fallbacks += 1
+                
+                probed += 1
+                label = labels[row_idx]
+                # Most rows are empty: skip the call for them
+                found = match_block(label, hs_codes[row_idx]) if label else None
+                if found is not None:
+                    label_hits += 1
+                    if found:
+                        self._add_block(row_idx)
+                        if predict and len(blocks) >= 3:
+                            last_stride = blocks[-1] - blocks[-2]
+                            if last_stride == blocks[-2] - blocks[-3] and last_stride >= min_stride:
+                                stride = last_stride
+                    else:
+                        rejected += 1
+                row_idx += 1
+            
+            metrics = self.progress.metrics
+            metrics.rows_scanned = probed
+            metrics.blocks_found = len(blocks)
+            metrics.blocks_skipped = len(blocks) - len(self.records)
+            metrics.labels_rejected = rejected
+            metrics.blocks_predicted = predicted
+            metrics.rows_jumped = jumped
+            metrics.locator_fallbacks = fallbacks
+            # Jumped rows are not tested one by one, but their labels are still read
+            metrics.cells_read = probed + bulk_read + label_hits + len(blocks) * len(self.plan)
+            
+            # Numbers were read raw: convert each column in one pass
+            self.plan.convert_columns(self.records)
+            
+            self._update_progress(3, f"✓ Tìm thấy {len(self.data_blocks)} khối dữ liệu")
+            return len(self.data_blocks)
+            
+        except ExtractionCancelled:
+            raise
+        except Exception as e:
+            self._set_error(f"Lỗi khi tìm dữ liệu: {str(e)}")
+            return 0
+    
+    def find_data_blocks_sharded(self, workers: int, shards: int = 0) -> int:
+        """find_data_blocks() over row-range shards scanned in parallel processes
+        
+        The sheet is cut into shards (default: one per worker) of whole rows.
+        A shard owns the blocks whose label row falls inside its range and
+        also receives the block_span rows after it, so a block crossing the
+        boundary is read whole by the shard it starts in and never twice.
+        Each shard runs the normal locator on its own rows; blocks, line
+        items and scan counters are merged back in row order, giving the
+        same data_blocks and records as a single scan.
+        
+        Experimental, and not faster than find_data_blocks() at present:
+        every call starts its own pool and pickles the shard's column slices
+        to it, which costs more than the scan (about 90 ms against 20 ms on
+        an 80k-row sheet). Nothing is shared between the processes.
+        """
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        
+        self._update_progress(2, "Đang tìm kiếm các khối dữ liệu...")
+        self.data_blocks = []
+        self.records = ResultSet()
         
-        # Bỏ dấu chấm (thousands separator)
-        value_str = value_str.replace('.', '')
-        # Đổi dấu phẩy thành dấu chấm (decimal separator)
-        value_str = value_str.replace(',', '.')
+        nrows = self.snapshot.nrows
+        span = self.layout.block_span
+        ranges = split_row_ranges(nrows, shards or workers)
+        jobs = [{
+            'extractor': type(self),
+            'input_file': self.input_file,
+            'layout': self.layout,
+            'predict': self.PREDICT_STRIDE,
+            'offset': start,
+            'nrows': stop - start,
+            'ncols': self.snapshot.ncols,
+            # Overlap: the rows of a block starting near the end of the range
+            'columns': {col: values[start:stop + span] for col, values in self.snapshot.columns.items()},
+        } for start, stop in ranges]
+        
+        results = [None] * len(jobs)
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(jobs)))
+        try:
+            pending = {executor.submit(scan_shard, job): idx for idx, job in enumerate(jobs)}
+            del jobs
+            while pending:
+                done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                self.cancel_token.raise_if_cancelled()
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+                self._update_progress(2, f"Đang tìm kiếm các khối dữ liệu "
+                                         f"({len(ranges) - len(pending)}/{len(ranges)} phần)...")
+        except ExtractionCancelled:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        except Exception as e:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._set_error(f"Lỗi khi tìm dữ liệu: {str(e)}")
+            return 0
+        executor.shutdown()
+        
+        metrics = self.progress.metrics
+        for name in metrics.SCAN_COUNTERS:
+            setattr(metrics, name, 0)
+        for result in results:
+            if result['error']:
+                self._set_error(result['error'])
+                return 0
+            self.data_blocks.extend(result['blocks'])
+            self.records.extend(result['records'])
+            for name, value in result['counters'].items():
+                setattr(metrics, name, getattr(metrics, name) + value)
+        
+        self._update_progress(3, f"✓ Tìm thấy {len(self.data_blocks)} khối dữ liệu")
+        return len(self.data_blocks)
+    
+    def _release_workbook(self):
+        """Drop the workbook once the snapshot is built"""
+        if self.workbook is not None:
+            if self.is_xls:
+                self.workbook.release_resources()
+            else:
+                # Read-only workbooks keep the file open until closed
+                self.workbook.close()
+        self.workbook = None
+        self.sheet = None
+    
+    def extract_block_data(self, start_row: int) -> Optional[LineItem]:
+        """Extract the line item of the block starting at a 0-based row
         
-        return value_str
+        Number fields are raw cell values until the scan converts the columns.
+        """
+        try:
+            return self._read_block(start_row)
+        except Exception:
+            return None
+    
+    def _add_block(self, start_row: int):
+        """Register a block found by the scan and extract its line item right away"""
+        self.data_blocks.append(start_row)
+        data = self.extract_block_data(start_row)
+        if data:
+            self.records.append(data)
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get counts of the last scan"""
+        return {
+            'blocks': len(self.data_blocks),
+            'items': len(self.records),
+            'skipped': len(self.data_blocks) - len(self.records),
+        }
+    
+    @staticmethod
+    def format_code(value) -> str:
+        """HS code as text, numeric cells without the trailing .0"""
+        if isinstance(value, (int, float)):
+            return str(int(value))
+        return str(value).strip() if value else ""
+    
+    @staticmethod
+    def format_text(value) -> str:
+        return str(value).strip() if value else ""
+    
+    @staticmethod
+    def format_number(value) -> Optional[float]:
+        """Number of one cell; columns are converted with normalize_numbers()"""
+        return normalize_numbers((value,))[0]
     
     def load_workbook(self) -> bool:
         """Load Excel workbook"""
         try:
             self._update_progress(0, f"Đang mở file: {Path(self.input_file).name}")
             
+            columns = self.get_columns()
+            padding = self.layout.block_span
+            
             if self.is_xls:
-                self.workbook = xlrd.open_workbook(self.input_file)
+                # on_demand parses only the workbook globals; the sheet itself
+                # is parsed by sheet_by_name, other sheets are never touched
+                self.workbook = open_xls(self.input_file)
                 self.sheet = self.workbook.sheet_by_name(self.get_sheet_name())
-                nrows = self.sheet.nrows
-                ncols = self.sheet.ncols
+                self.snapshot = SheetSnapshot.from_xlrd(self.sheet, columns, padding)
+            elif self.is_streaming and self.RAW_XLSX:
+                with XlsxSheetReader(self.input_file, self.get_sheet_name()) as reader:
+                    self.snapshot = reader.read_columns(
+                        columns, padding, check=self.cancel_token.raise_if_cancelled
+                    )
+            elif self.is_streaming:
+                from openpyxl import load_workbook
+                # Read-only mode parses the sheet lazily while iterating rows
+                self.workbook = load_workbook(self.input_file, read_only=True, data_only=True)
+                self.sheet = self.workbook[self.get_sheet_name()]
+                self.snapshot = SheetSnapshot.from_rows(
+                    self._cancellable(self.sheet.iter_rows(values_only=True)), columns, padding
+                )
             else:
+                from openpyxl import load_workbook
                 self.workbook = load_workbook(self.input_file, data_only=True)
                 self.sheet = self.workbook[self.get_sheet_name()]
-                nrows = self.sheet.max_row
-                ncols = self.sheet.max_column
+                self.snapshot = SheetSnapshot.from_worksheet(self.sheet, columns, padding)
+            
+            self.cancel_token.raise_if_cancelled()
+            self._release_workbook()
+            self._read_block = self.plan.bind(self.snapshot)
+            self.progress.metrics.cells_loaded = self.snapshot.nrows * len(columns)
             
+            nrows = self.snapshot.nrows
+            ncols = self.snapshot.ncols
             self._update_progress(1, f"✓ Đã load sheet {self.get_sheet_name()} ({nrows} hàng, {ncols} cột)")
             return True
+        except ExtractionCancelled:
+            raise
         except Exception as e:
-            self.progress.has_error = True
-            self.progress.error_message = f"Lỗi khi mở file: {str(e)}"
-            if self.progress_callback:
-                self.progress_callback(self.progress)
+            # Unmap the file now rather than when the extractor is collected
+            self._release_workbook()
+            self._set_error(f"Lỗi khi mở file: {str(e)}")
             return False
     
-    def get_preview_data(self) -> List[Dict[str, str]]:
-        """Get preview of data blocks for display"""
-        preview = []
-        for idx, block_start in enumerate(self.data_blocks[:20], 1):
-            data = self.extract_block_data(block_start)
-            if data:
-                desc = data.get('description', '')
-                origin = data.get('origin', '')
-                if origin:
-                    desc_display = f"{desc} ({origin})"
-                else:
-                    desc_display = desc
+    def _cancellable(self, rows: Iterable, every: int = 256) -> Iterator:
+        """Pass rows through, checking the cancel token every few rows"""
+        check = self.cancel_token.raise_if_cancelled
+        for idx, row in enumerate(rows):
+            if not idx % every:
+                check()
+            yield row
+    
+    def preview(self, limit: int = 0) -> Preview:
+        """First line items of the declaration, without reading the whole sheet
+        
+        The sheet is streamed (.xlsx straight from the zip, see
+        XlsxSheetReader) and reading stops once limit blocks (default
+        PREVIEW_BLOCKS) are complete. The total is estimated from the stride
+        of the blocks found and the sheet height: its dimension, or for
+        sheets without one, the share of the sheet XML read so far.
+        records and data_blocks are left untouched.
+        
+        Raises:
+            OSError, KeyError, ValueError if the file or sheet cannot be read
+        """
+        start = time.perf_counter()
+        limit = limit or self.PREVIEW_BLOCKS
+        layout = self.layout
+        columns = self.get_columns()
+        width = max(columns) + 1
+        label_column = layout.label_column
+        key_column = layout.key_column
+        match_block = self.plan.match_block
+        
+        data = {col: [] for col in columns}
+        appenders = [(col, data[col].append) for col in columns]
+        blocks = []
+        stop_row = None
+        rows_read = 0
+        
+        with self._preview_rows(width) as (rows, estimate_rows):
+            for values in self._cancellable(rows):
+                row = rows_read
+                rows_read += 1
+                count = len(values)
+                for col, append in appenders:
+                    append(values[col] if col < count else None)
                 
-                preview.append({
-                    'index': idx,
-                    'hs_code': data.get('hs_code', ''),
-                    'description': desc_display[:100] + '...' if len(desc_display) > 100 else desc_display,
-                    'qty1': str(data.get('qty1', '')),
-                    'unit1': data.get('unit1', '')
-                })
+                if stop_row is None:
+                    label = values[label_column] if label_column < count else None
+                    key = values[key_column] if key_column < count else None
+                    if match_block(label, key):
+                        blocks.append(row)
+                        if len(blocks) == limit:
+                            # Keep reading to the last row of this block
+                            stop_row = row + layout.block_span - 1
+                if stop_row is not None and row >= stop_row:
+                    break
+            total_rows = estimate_rows(rows_read)
+        
+        for col_values in data.values():
+            col_values.extend([None] * layout.block_span)
+        read_block = self.plan.bind(SheetSnapshot(data, rows_read, width))
+        items = ResultSet()
+        for row in blocks:
+            try:
+                items.append(read_block(row))
+            except Exception:
+                pass
+        self.plan.convert_columns(items)
+        
+        complete = stop_row is None
+        estimated = len(blocks)
+        if not complete and len(blocks) >= 2:
+            stride = (blocks[-1] - blocks[0]) / (len(blocks) - 1)
+            estimated += max(0, int((total_rows - 1 - blocks[-1]) / stride))
+        return Preview(items, estimated, complete, rows_read, time.perf_counter() - start)
+    
+    @contextmanager
+    def _preview_rows(self, width: int):
+        """(row iterator, estimate of the sheet height from rows read) for preview()"""
+        if self.is_xls:
+            workbook = open_xls(self.input_file)
+            try:
+                sheet = workbook.sheet_by_name(self.get_sheet_name())
+                end = min(width, sheet.ncols)
+                rows = (sheet.row_values(row, 0, end) for row in range(sheet.nrows))
+                yield rows, lambda rows_read: sheet.nrows
+            finally:
+                workbook.release_resources()
+            return
+        
+        with XlsxSheetReader(self.input_file, self.get_sheet_name()) as reader:
+            def estimate_rows(rows_read: int) -> int:
+                if reader.dimension_rows:
+                    return reader.dimension_rows
+                fraction = reader.fraction_read()
+                return int(rows_read / fraction) if fraction else rows_read
+            
+            yield reader.iter_rows(width), estimate_rows
+    
+    def get_preview_data(self, items: Optional[Iterable[LineItem]] = None) -> List[Dict[str, str]]:
+        """Line items formatted for display: the given ones (e.g. preview().items)
+        or the first extracted ones"""
+        if items is None:
+            items = self.records[:self.PREVIEW_BLOCKS]
+        preview = []
+        for idx, data in enumerate(items, 1):
+            desc = data.description
+            origin = data.origin
+            if origin:
+                desc_display = f"{desc} ({origin})"
+            else:
+                desc_display = desc
+            
+            preview.append({
+                'index': idx,
+                'hs_code': data.hs_code,
+                'description': desc_display[:100] + '...' if len(desc_display) > 100 else desc_display,
+                'qty1': '' if data.qty1 is None else str(data.qty1),
+                'unit1': data.unit1
+            })
         return preview
     
-    def create_output_file(self, output_file: str) -> bool:
-        """Create Excel output file with extracted data"""
+    def create_output_file(self, output_file: str, output_format: Optional[str] = None) -> bool:
+        """Create output file with extracted data
+        
+        Args:
+            output_file: Output path
+            output_format: xlsx, csv, jsonl or parquet (default: from the extension)
+        """
         try:
             self._update_progress(4, f"Đang tạo file output...")
+            check_cancelled = self.cancel_token.raise_if_cancelled
             
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "data"
-            
-            # Header
-            headers = [
-                "Mô tả hàng hóa", 
-                "Xuất xứ",
-                "Mã số hàng hóa", 
-                "Số lượng (1)", 
-                "Đơn vị 1", 
-                "Số lượng (2)", 
-                "Đơn vị 2",
-                "Đơn giá hóa đơn",
-                "Trị giá hóa đơn"
-            ]
-            ws.append(headers)
-            
-            # Format header
-            header_font = Font(bold=True, size=11, color="FFFFFF")
-            header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-            header_alignment = Alignment(horizontal="center", vertical="center")
-            
-            for cell in ws[1]:
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = header_alignment
-            
-            # Write data
-            total_blocks = len(self.data_blocks)
-            for idx, block_start in enumerate(self.data_blocks, 1):
-                self._update_progress(4 + idx, f"Đang ghi dữ liệu khối {idx}/{total_blocks}...")
-                
-                data = self.extract_block_data(block_start)
-                if data:
-                    row = [
-                        data.get('description', ''),
-                        data.get('origin', ''),
-                        data.get('hs_code', ''),
-                        data.get('qty1', ''),
-                        data.get('unit1', ''),
-                        data.get('qty2', ''),
-                        data.get('unit2', ''),
-                        data.get('unit_price', ''),
-                        data.get('invoice_value', '')
-                    ]
-                    ws.append(row)
-            
-            # Format columns
-            ws.column_dimensions['A'].width = 70
-            ws.column_dimensions['B'].width = 10
-            ws.column_dimensions['C'].width = 15
-            ws.column_dimensions['D'].width = 15
-            ws.column_dimensions['E'].width = 12
-            ws.column_dimensions['F'].width = 15
-            ws.column_dimensions['G'].width = 12
-            ws.column_dimensions['H'].width = 18
-            ws.column_dimensions['I'].width = 18
-            
-            # Borders
-            thin_border = Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
+            def on_row(idx: int, total: int):
+                # Raising here aborts the sink, which deletes the partial file
+                check_cancelled()
+                # Check the throttle first to skip formatting coalesced messages
+                if self._progress_throttle and self._progress_throttle.is_due():
+                    self._update_progress(4 + idx, f"Đang ghi dữ liệu khối {idx}/{total}...", transient=True)
             
-            for row in ws.iter_rows(min_row=1, max_row=len(self.data_blocks) + 1, 
-                                   min_col=1, max_col=9):
-                for cell in row:
-                    cell.border = thin_border
-                    cell.alignment = Alignment(vertical="top", wrap_text=True)
-            
-            # Save
-            wb.save(output_file)
-            self._update_progress(4 + total_blocks + 1, f"✓ Đã lưu file: {Path(output_file).name}")
+            write_output_file(output_file, self.records, on_row=on_row, output_format=output_format)
+            self._update_progress(4 + len(self.records) + 1, f"✓ Đã lưu file: {Path(output_file).name}")
             return True
             
+        except ExtractionCancelled:
+            raise
         except Exception as e:
-            self.progress.has_error = True
-            self.progress.error_message = f"Lỗi khi tạo file: {str(e)}"
-            if self.progress_callback:
-                self.progress_callback(self.progress)
+            self._set_error(f"Lỗi khi tạo file: {str(e)}")
             return False
     
-    def run(self, output_file: str) -> bool:
-        """Run complete extraction process"""
+    def _check_cache(self) -> Tuple[Optional[str], bool]:
+        """(cache key of the file or None, whether records were loaded from the cache)"""
+        if self.cache is None:
+            return None, False
+        with self.progress.metrics.phase('cache'):
+            try:
+                cache_key = self.cache.make_key(
+                    self.input_file, f"{self.layout.name}-{self.layout.fingerprint}", self.layout.version
+                )
+            except OSError:
+                # Unreadable file: let load_workbook report the error
+                return None, False
+            hit = self._load_from_cache(cache_key)
+        if hit:
+            self.progress.total_steps = 5 + len(self.records)
+        return cache_key, hit
+    
+    def _load_from_cache(self, cache_key: str) -> bool:
+        """Fill data_blocks and records from the cache, if the file is cached"""
+        entry = self.cache.get(cache_key)
+        if entry is None:
+            return False
+        
+        self.data_blocks = entry['blocks']
+        self.records = ResultSet.from_columns(entry['fields'], entry['columns'])
+        self.from_cache = True
+        self._update_progress(3, f"✓ Dùng kết quả đã lưu: {len(self.records)} khối dữ liệu (file không thay đổi)")
+        return True
+    
+    @contextmanager
+    def _profiling(self):
+        """Run the enclosed block under cProfile and tracemalloc in profile mode"""
+        if not self.profile or self._profiling_active:
+            yield
+            return
+        
+        self._profiling_active = True
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.profiler is None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+            if started_tracing:
+                tracemalloc.stop()
+            self._profiling_active = False
+    
+    def save_profile(self, path: str):
+        """Write the cProfile data (profile mode) for snakeviz/pstats"""
+        if self.profiler is not None:
+            self.profiler.dump_stats(path)
+    
+    def get_profile_summary(self, limit: int = 20) -> str:
+        """Top functions by cumulative time (profile mode)"""
+        if self.profiler is None:
+            return ""
+        import pstats
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+    
+    def get_report(self) -> Dict[str, any]:
+        """Machine-readable timing and counter report of the last run"""
+        report = self.progress.metrics.to_dict()
+        report['input_file'] = self.input_file
+        report['extractor'] = type(self).__name__
+        report['from_cache'] = self.from_cache
+        report['items'] = len(self.records)
+        return report
+    
+    def cancel(self):
+        """Ask the run to stop; safe to call from any thread"""
+        self.cancel_token.cancel()
+    
+    def _on_cancelled(self):
+        """Drop everything a cancelled run holds and report it"""
+        self._release_workbook()
+        self.snapshot = None
+        self._read_block = None
+        self.data_blocks = []
+        self.records = ResultSet()
+        self.progress.is_cancelled = True
+        self._set_error("Đã hủy trích xuất")
+    
+    def extract(self) -> bool:
+        """Load the workbook and extract all line items into self.records"""
+        with self._profiling():
+            try:
+                return self._extract()
+            except ExtractionCancelled:
+                self._on_cancelled()
+                return False
+    
+    def _extract(self) -> bool:
         self.progress.total_steps = 5 + len(self.data_blocks) if hasattr(self, 'data_blocks') else 10
+        metrics = self.progress.metrics
         
-        if not self.load_workbook():
+        cache_key, hit = self._check_cache()
+        if hit:
+            return True
+        
+        with metrics.phase('load'):
+            loaded = self.load_workbook()
+        if not loaded:
             return False
         
-        num_blocks = self.find_data_blocks()
+        with metrics.phase('scan'):
+            if self.shard_workers > 1 and self.snapshot.nrows >= self.SHARD_MIN_ROWS:
+                num_blocks = self.find_data_blocks_sharded(self.shard_workers)
+            else:
+                num_blocks = self.find_data_blocks()
         if num_blocks == 0:
-            self.progress.has_error = True
-            self.progress.error_message = "Không tìm thấy dữ liệu nào!"
-            if self.progress_callback:
-                self.progress_callback(self.progress)
+            self._set_error("Không tìm thấy dữ liệu nào!")
             return False
         
-        self.progress.total_steps = 5 + num_blocks
+        if cache_key and self.records:
+            self.cache.put(cache_key, self.records.fields, self.records.columns, self.data_blocks)
         
-        if not self.create_output_file(output_file):
-            return False
+        self.progress.total_steps = 5 + len(self.records)
+        return True
+    
+    def run(self, output_file: str, output_format: Optional[str] = None) -> bool:
+        """Run complete extraction process"""
+        with self._profiling():
+            if self.pipelined:
+                if not self.run_pipelined(output_file, output_format):
+                    return False
+            else:
+                if not self.extract():
+                    return False
+                
+                try:
+                    with self.progress.metrics.phase('write'):
+                        written = self.create_output_file(output_file, output_format)
+                except ExtractionCancelled:
+                    self._on_cancelled()
+                    return False
+                if not written:
+                    return False
         
         self.progress.is_complete = True
         self.progress.current_step = self.progress.total_steps
-        self.progress.status_message = f"✓ Hoàn thành! Đã trích xuất {num_blocks} khối dữ liệu"
-        if self.progress_callback:
-            self.progress_callback(self.progress)
+        self.progress.status_message = f"✓ Hoàn thành! Đã trích xuất {len(self.records)} khối dữ liệu"
+        self._notify_progress()
         
         return True
-
-
-class ExportExtractor(BaseExtractor):
-    """Extractor for Export declarations (TKX)"""
-    
-    # Column definitions (0-based)
-    COL_LABEL = 2
-    COL_VALUE = 5       # Column F
-    COL_QTY_VALUE = 16  # Column Q
-    COL_UNIT = 24       # Column Y
-    COL_INVOICE_PRICE = 17  # Column R
     
-    # Offsets
-    OFFSET_DESCRIPTION = 1
-    OFFSET_QTY1 = 4
-    OFFSET_QTY2 = 5
-    OFFSET_INVOICE = 6
-    
-    def get_sheet_name(self) -> str:
-        return 'TKX'
-    
-    @staticmethod
-    def extract_origin(description: str) -> tuple:
-        """Extract country of origin from description pattern #&XX"""
-        if not description:
-            return "", ""
+    def run_pipelined(self, output_file: str, output_format: Optional[str] = None) -> bool:
+        """Extract and write with reading, extraction and writing overlapped
         
-        pattern = r'#&([A-Z]{2,})\s*$'
-        match = re.search(pattern, description)
+        Three stages joined by bounded queues run at the same time:
         
-        if match:
-            origin = match.group(1)
-            return description, origin
+        - read: streams the sheet into the snapshot (.xlsx through
+          XlsxSheetReader, other files are loaded first) and tests every
+          row for a block label, queueing each block once its last row is in
+        - extract: reads the line items of queued blocks and converts the
+          number columns of each batch of PIPELINE_BATCH items
+        - write: streams the batches into the output sink (calling thread)
         
-        return description, ""
+        Rows reach the output while the sheet is still being read, but the
+        stages are threads sharing the GIL, so little work really overlaps:
+        on an 80k-row .xlsx the run is no faster than the serial path, and
+        often slower (about 0.9 s against 0.8 s to xlsx, 0.6 s against 0.5 s
+        to csv). Experimental; only the first output rows come earlier.
+        data_blocks, records and the cache entry end up as with extract()
+        followed by create_output_file(). Called by run() for pipelined
+        extractors.
+        """
+        with self._profiling():
+            cache_key, hit = self._check_cache()
+            try:
+                if hit:
+                    with self.progress.metrics.phase('write'):
+                        return self.create_output_file(output_file, output_format)
+                with self.progress.metrics.phase('pipeline'):
+                    done = self._run_pipeline(output_file, output_format)
+            except ExtractionCancelled:
+                self._on_cancelled()
+                return False
+            if not done:
+                return False
+            if cache_key and self.records:
+                self.cache.put(cache_key, self.records.fields, self.records.columns, self.data_blocks)
+            return True
     
-    def find_data_blocks(self) -> int:
-        """Find all data blocks in export sheet"""
-        try:
-            self._update_progress(2, "Đang tìm kiếm các khối dữ liệu...")
-            self.data_blocks = []
-            
-            if self.is_xls:
-                max_rows = self.sheet.nrows
-            else:
-                max_rows = self.sheet.max_row
-            
-            for row_idx in range(max_rows):
+    def _run_pipeline(self, output_file: str, output_format: Optional[str]) -> bool:
+        layout = self.layout
+        span = layout.block_span
+        label_column = layout.label_column
+        key_column = layout.key_column
+        match_block = self.plan.match_block
+        metrics = self.progress.metrics
+        check_cancelled = self.cancel_token.raise_if_cancelled
+        
+        self.data_blocks = []
+        self.records = ResultSet()
+        blocks = queue.Queue(self.PIPELINE_QUEUE)
+        batches = queue.Queue(max(2, self.PIPELINE_QUEUE // self.PIPELINE_BATCH))
+        stop = threading.Event()
+        # (error message prefix, exception) of failed stages, first failure first
+        failures = []
+        
+        def put(target: queue.Queue, item):
+            while True:
                 try:
-                    if self.is_xls:
-                        cell_value = self.get_cell_value(row_idx, self.COL_LABEL)
-                    else:
-                        cell_value = self.get_cell_value(row_idx + 1, self.COL_LABEL + 1)
-                    
-                    if cell_value and "Mã số hàng hóa" in str(cell_value):
-                        if self.is_xls:
-                            hs_code = self.get_cell_value(row_idx, self.COL_VALUE)
-                        else:
-                            hs_code = self.get_cell_value(row_idx + 1, self.COL_VALUE + 1)
-                        
-                        hs_code_str = str(hs_code).strip() if hs_code else ""
-                        
-                        if isinstance(hs_code, (int, float)):
-                            hs_code_str = str(int(hs_code))
-                        
-                        if hs_code_str.isdigit() and len(hs_code_str) == 8:
-                            if self.is_xls:
-                                self.data_blocks.append(row_idx)
-                            else:
-                                self.data_blocks.append(row_idx + 1)
-                except:
-                    continue
-            
-            self._update_progress(3, f"✓ Tìm thấy {len(self.data_blocks)} khối dữ liệu")
-            return len(self.data_blocks)
-            
-        except Exception as e:
-            self.progress.has_error = True
-            self.progress.error_message = f"Lỗi khi tìm dữ liệu: {str(e)}"
-            if self.progress_callback:
-                self.progress_callback(self.progress)
-            return 0
-    
-    def extract_block_data(self, start_row: int) -> Optional[Dict[str, any]]:
-        """Extract data from export declaration block"""
-        data = {}
+                    target.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    if stop.is_set():
+                        raise ExtractionCancelled()
         
-        try:
-            if self.is_xls:
-                hs_code = self.get_cell_value(start_row, self.COL_VALUE)
-                description_raw = self.get_cell_value(start_row + self.OFFSET_DESCRIPTION, self.COL_VALUE)
-                qty1 = self.get_cell_value(start_row + self.OFFSET_QTY1, self.COL_QTY_VALUE)
-                unit1 = self.get_cell_value(start_row + self.OFFSET_QTY1, self.COL_UNIT)
-                qty2 = self.get_cell_value(start_row + self.OFFSET_QTY2, self.COL_QTY_VALUE)
-                unit2 = self.get_cell_value(start_row + self.OFFSET_QTY2, self.COL_UNIT)
-                invoice_value = self.get_cell_value(start_row + self.OFFSET_INVOICE, self.COL_VALUE)
-                unit_price = self.get_cell_value(start_row + self.OFFSET_INVOICE, self.COL_INVOICE_PRICE)
-            else:
-                hs_code = self.get_cell_value(start_row, self.COL_VALUE + 1)
-                description_raw = self.get_cell_value(start_row + self.OFFSET_DESCRIPTION, self.COL_VALUE + 1)
-                qty1 = self.get_cell_value(start_row + self.OFFSET_QTY1, self.COL_QTY_VALUE + 1)
-                unit1 = self.get_cell_value(start_row + self.OFFSET_QTY1, self.COL_UNIT + 1)
-                qty2 = self.get_cell_value(start_row + self.OFFSET_QTY2, self.COL_QTY_VALUE + 1)
-                unit2 = self.get_cell_value(start_row + self.OFFSET_QTY2, self.COL_UNIT + 1)
-                invoice_value = self.get_cell_value(start_row + self.OFFSET_INVOICE, self.COL_VALUE + 1)
-                unit_price = self.get_cell_value(start_row + self.OFFSET_INVOICE, self.COL_INVOICE_PRICE + 1)
+        def get(source: queue.Queue, on_idle: Callable[[], None]):
+            while True:
+                try:
+                    return source.get(timeout=0.1)
+                except queue.Empty:
+                    on_idle()
+        
+        # Read stage --------------------------------------------------------
+        pending = deque()
+        counts = {'rows': 0, 'rejected': 0}
+        
+        def release_ready(snapshot: SheetSnapshot, last_row: Optional[int]):
+            """Queue the pending blocks whose rows are all read (all with last_row None)"""
+            while pending and (last_row is None or pending[0] + span - 1 <= last_row):
+                start = pending.popleft()
+                # Fill the gaps left by empty trailing cells up to the block end
+                for values in snapshot.columns.values():
+                    if len(values) < start + span:
+                        values.extend([None] * (start + span - len(values)))
+                put(blocks, start)
+        
+        def scan_row(snapshot: SheetSnapshot, row: int):
+            if snapshot is not self.snapshot:
+                # First row of a streamed sheet: extract from the growing snapshot
+                self.snapshot = snapshot
+                self._read_block = self.plan.bind(snapshot)
+            counts['rows'] += 1
+            labels = snapshot.columns[label_column]
+            label = labels[row] if row < len(labels) else None
+            if label:
+                keys = snapshot.columns[key_column]
+                found = match_block(label, keys[row] if row < len(keys) else None)
+                if found:
+                    pending.append(row)
+                elif found is not None:
+                    counts['rejected'] += 1
+            release_ready(snapshot, row)
+        
+        def read():
+            def check():
+                check_cancelled()
+                if stop.is_set():
+                    raise ExtractionCancelled()
             
-            # HS code
-            if isinstance(hs_code, (int, float)):
-                data['hs_code'] = str(int(hs_code))
+            if self.is_streaming and self.RAW_XLSX:
+                with XlsxSheetReader(self.input_file, self.get_sheet_name()) as reader:
+                    self.snapshot = reader.read_columns(self.get_columns(), span, check, on_row=scan_row)
             else:
-                data['hs_code'] = str(hs_code).strip() if hs_code else ""
+                if not self.load_workbook():
+                    raise ValueError(self.progress.error_message)
+                for row in range(self.snapshot.nrows):
+                    if not row & 255:
+                        check()
+                    scan_row(self.snapshot, row)
+            release_ready(self.snapshot, None)
+            put(blocks, None)
+        
+        # Extract stage -----------------------------------------------------
+        def extract():
+            batch_size = self.PIPELINE_BATCH
+            batch = ResultSet()
             
-            # Description + origin
-            description_str = str(description_raw).strip() if description_raw else ""
-            original_desc, origin = self.extract_origin(description_str)
-            data['description'] = original_desc
-            data['origin'] = origin
+            def flush():
+                nonlocal batch
+                if batch:
+                    self.plan.convert_columns(batch)
+                    put(batches, batch)
+                    batch = ResultSet()
             
-            # Format numbers
-            data['qty1'] = self.format_number(qty1)
-            data['unit1'] = str(unit1).strip() if unit1 else ""
-            data['qty2'] = self.format_number(qty2)
-            data['unit2'] = str(unit2).strip() if unit2 else ""
-            data['invoice_value'] = self.format_number(invoice_value)
-            data['unit_price'] = self.format_number(unit_price)
+            def on_idle():
+                if stop.is_set():
+                    raise ExtractionCancelled()
+                # Hand over what is there while the reader catches up
+                flush()
             
-            return data
+            while True:
+                start = get(blocks, on_idle)
+                if start is None:
+                    break
+                self.data_blocks.append(start)
+                item = self.extract_block_data(start)
+                if item is not None:
+                    batch.append(item)
+                if len(batch) >= batch_size:
+                    flush()
+            flush()
+            put(batches, None)
+        
+        def stage(target: Callable[[], None], prefix: str) -> threading.Thread:
+            def run_stage():
+                try:
+                    target()
+                except BaseException as e:
+                    failures.append((prefix, e))
+                    stop.set()
             
+            thread = threading.Thread(target=run_stage, name=f"pipeline-{target.__name__}", daemon=True)
+            thread.start()
+            return thread
+        
+        # Write stage (this thread) -----------------------------------------
+        def on_idle():
+            check_cancelled()
+            if failures:
+                raise failures[0][1]
+        
+        self._update_progress(0, f"Đang mở file: {Path(self.input_file).name}")
+        threads = []
+        try:
+            sink = get_output_sink(output_file, output_format)
+            sink.open()
+            try:
+                threads.append(stage(read, "Lỗi khi mở file"))
+                threads.append(stage(extract, "Lỗi khi tìm dữ liệu"))
+                write = sink.write_row
+                keys = sink.keys
+                while True:
+                    batch = get(batches, on_idle)
+                    if batch is None:
+                        break
+                    check_cancelled()
+                    for values in batch.rows(keys):
+                        write(values)
+                    self.records.extend(batch)
+                    if self._progress_throttle and self._progress_throttle.is_due():
+                        self._update_progress(4, f"Đang ghi dữ liệu khối {len(self.records)}...", transient=True)
+            except BaseException:
+                # Deletes the partial file, as leaving the with block of a sink does
+                sink.abort()
+                raise
+            if self.data_blocks:
+                sink.close()
+            else:
+                # Nothing found: leave no empty output behind
+                sink.abort()
+        except ExtractionCancelled:
+            raise
         except Exception as e:
-            return None
+            if not self.progress.has_error:
+                prefix = next((prefix for prefix, error in failures if error is e), "Lỗi khi tạo file")
+                self._set_error(f"{prefix}: {str(e)}")
+            return False
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        
+        if not self.data_blocks:
+            self._set_error("Không tìm thấy dữ liệu nào!")
+            return False
+        
+        metrics.rows_scanned = counts['rows']
+        metrics.labels_rejected = counts['rejected']
+        metrics.blocks_found = len(self.data_blocks)
+        metrics.blocks_skipped = len(self.data_blocks) - len(self.records)
+        metrics.cells_loaded = self.snapshot.nrows * len(self.get_columns())
+        self.progress.total_steps = 5 + len(self.records)
+        self._update_progress(4 + len(self.records) + 1, f"✓ Đã lưu file: {Path(output_file).name}")
+        return True
+
+
+class ExportExtractor(BaseExtractor):
+    """Extractor for Export declarations (TKX)"""
+    
+    LAYOUT = EXPORT_LAYOUT
 
 
 class ImportExtractor(BaseExtractor):
     """Extractor for Import declarations (TKN)"""
     
-    # Column definitions (0-based)
-    COL_LABEL = 2       # Column C
-    COL_VALUE = 6       # Column G
-    COL_QTY_VALUE = 21  # Column V
-    COL_UNIT = 30       # Column AF (31 in 1-based = PCE)
-    COL_INVOICE_VALUE = 8   # Column I
-    COL_ORIGIN = 23     # Column X
-    
-    # Offsets
-    OFFSET_DESCRIPTION = 1
-    OFFSET_QTY1 = 4
-    OFFSET_QTY2 = 5
-    OFFSET_INVOICE = 6
-    OFFSET_ORIGIN = 11  # Row N+11 for origin
+    LAYOUT = IMPORT_LAYOUT
+
+
+class SpecExtractor(BaseExtractor):
+    """Extractor for a declaration layout loaded from a JSON spec file"""
     
-    def get_sheet_name(self) -> str:
-        return 'TKN'
+    def __init__(self, input_file: str, layout: LayoutSpec, **kwargs):
+        super().__init__(input_file, layout=layout, **kwargs)
+
+
+EXTRACTORS = {
+    DeclarationType.EXPORT: ExportExtractor,
+    DeclarationType.IMPORT: ImportExtractor,
+}
+
+
+def warm_up() -> float:
+    """Import the Excel libraries ahead of the first extraction
     
-    def find_data_blocks(self) -> int:
-        """Find all data blocks in import sheet"""
-        try:
-            self._update_progress(2, "Đang tìm kiếm các khối dữ liệu...")
-            self.data_blocks = []
-            
-            if self.is_xls:
-                max_rows = self.sheet.nrows
-            else:
-                max_rows = self.sheet.max_row
-            
-            for row_idx in range(max_rows):
-                try:
-                    if self.is_xls:
-                        cell_value = self.get_cell_value(row_idx, self.COL_LABEL)
-                    else:
-                        cell_value = self.get_cell_value(row_idx + 1, self.COL_LABEL + 1)
-                    
-                    if cell_value and "Mã số hàng hóa" in str(cell_value):
-                        if self.is_xls:
-                            hs_code = self.get_cell_value(row_idx, self.COL_VALUE)
-                        else:
-                            hs_code = self.get_cell_value(row_idx + 1, self.COL_VALUE + 1)
-                        
-                        hs_code_str = str(hs_code).strip() if hs_code else ""
-                        
-                        if isinstance(hs_code, (int, float)):
-                            hs_code_str = str(int(hs_code))
-                        
-                        if hs_code_str.isdigit() and len(hs_code_str) == 8:
-                            if self.is_xls:
-                                self.data_blocks.append(row_idx)
-                            else:
-                                self.data_blocks.append(row_idx + 1)
-                except:
-                    continue
-            
-            self._update_progress(3, f"✓ Tìm thấy {len(self.data_blocks)} khối dữ liệu")
-            return len(self.data_blocks)
-            
-        except Exception as e:
-            self.progress.has_error = True
-            self.progress.error_message = f"Lỗi khi tìm dữ liệu: {str(e)}"
-            if self.progress_callback:
-                self.progress_callback(self.progress)
-            return 0
+    Meant for a background thread started once the GUI window is shown.
+    Imports are serialized by the import lock, so an extraction started
+    meanwhile simply waits for the warm-up to finish.
     
-    def extract_block_data(self, start_row: int) -> Optional[Dict[str, any]]:
-        """Extract data from import declaration block"""
-        data = {}
-        
+    Returns:
+        Seconds spent importing
+    """
+    start = time.perf_counter()
+    import xlrd  # noqa: F401
+    import openpyxl  # noqa: F401
+    import openpyxl.cell  # noqa: F401
+    import openpyxl.styles  # noqa: F401
+    import openpyxl.utils  # noqa: F401
+    return time.perf_counter() - start
+
+
+def open_xls(input_file: str):
+    """xlrd workbook (on_demand) parsed from a read-only memory map of the file
+    
+    The file is not read into a bytes object: xlrd parses the records
+    straight from the mapping, so concurrent workers share the page cache
+    instead of each holding a copy. The workbook owns the mapping and
+    release_resources() unmaps it; if parsing fails it is unmapped here.
+    """
+    import mmap
+    import xlrd
+    
+    with open(input_file, 'rb') as f:
         try:
-            if self.is_xls:
-                hs_code = self.get_cell_value(start_row, self.COL_VALUE)
-                description_raw = self.get_cell_value(start_row + self.OFFSET_DESCRIPTION, self.COL_VALUE)
-                qty1 = self.get_cell_value(start_row + self.OFFSET_QTY1, self.COL_QTY_VALUE)
-                unit1 = self.get_cell_value(start_row + self.OFFSET_QTY1, self.COL_UNIT)
-                qty2 = self.get_cell_value(start_row + self.OFFSET_QTY2, self.COL_QTY_VALUE)
-                unit2 = self.get_cell_value(start_row + self.OFFSET_QTY2, self.COL_UNIT)
-                invoice_value = self.get_cell_value(start_row + self.OFFSET_INVOICE, self.COL_INVOICE_VALUE)
-                unit_price = self.get_cell_value(start_row + self.OFFSET_INVOICE, self.COL_QTY_VALUE)
-                origin = self.get_cell_value(start_row + self.OFFSET_ORIGIN, self.COL_ORIGIN)
-            else:
-                hs_code = self.get_cell_value(start_row, self.COL_VALUE + 1)
-                description_raw = self.get_cell_value(start_row + self.OFFSET_DESCRIPTION, self.COL_VALUE + 1)
-                qty1 = self.get_cell_value(start_row + self.OFFSET_QTY1, self.COL_QTY_VALUE + 1)
-                unit1 = self.get_cell_value(start_row + self.OFFSET_QTY1, self.COL_UNIT + 1)
-                qty2 = self.get_cell_value(start_row + self.OFFSET_QTY2, self.COL_QTY_VALUE + 1)
-                unit2 = self.get_cell_value(start_row + self.OFFSET_QTY2, self.COL_UNIT + 1)
-                invoice_value = self.get_cell_value(start_row + self.OFFSET_INVOICE, self.COL_INVOICE_VALUE + 1)
-                unit_price = self.get_cell_value(start_row + self.OFFSET_INVOICE, self.COL_QTY_VALUE + 1)
-                origin = self.get_cell_value(start_row + self.OFFSET_ORIGIN, self.COL_ORIGIN + 1)
-            
-            # HS code
-            if isinstance(hs_code, (int, float)):
-                data['hs_code'] = str(int(hs_code))
-            else:
-                data['hs_code'] = str(hs_code).strip() if hs_code else ""
-            
-            # Description (no origin extraction from text)
-            data['description'] = str(description_raw).strip() if description_raw else ""
-            
-            # Origin from dedicated row/cell
-            data['origin'] = str(origin).strip() if origin else ""
-            
-            # Format numbers
-            data['qty1'] = self.format_number(qty1)
-            data['unit1'] = str(unit1).strip() if unit1 else ""
-            data['qty2'] = self.format_number(qty2)
-            data['unit2'] = str(unit2).strip() if unit2 else ""
-            data['invoice_value'] = self.format_number(invoice_value)
-            data['unit_price'] = self.format_number(unit_price)
-            
-            return data
-            
-        except Exception as e:
-            return None
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file: let xlrd report it
+            return xlrd.open_workbook(input_file, on_demand=True)
+    try:
+        return xlrd.open_workbook(file_contents=mapping, on_demand=True)
+    except BaseException:
+        mapping.close()
+        raise
+
+
+def probe_workbook(input_file: str) -> List[str]:
+    """Sheet names of a workbook, read from its sheet directory without parsing any sheet"""
+    if Path(input_file).suffix.lower() == '.xls':
+        workbook = open_xls(input_file)
+        try:
+            return workbook.sheet_names()
+        finally:
+            workbook.release_resources()
+    
+    import zipfile
+    from xml.etree import ElementTree
+    
+    with zipfile.ZipFile(input_file) as archive:
+        root = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    # Match on the local name: strict OOXML files use a different namespace
+    return [elem.get('name') for elem in root.iter() if elem.tag.rsplit('}', 1)[-1] == 'sheet']
+
+
+def detect_declaration_types(input_file: str) -> List[DeclarationType]:
+    """Declaration types whose sheet (TKX, TKN) the workbook contains, possibly both or none"""
+    sheet_names = set(probe_workbook(input_file))
+    return [decl_type for decl_type, cls in EXTRACTORS.items() if cls.LAYOUT.sheet_name in sheet_names]
+
+
+def split_row_ranges(nrows: int, shards: int) -> List[Tuple[int, int]]:
+    """[start, stop) row ranges of about equal size covering nrows rows"""
+    shards = max(1, min(shards, nrows))
+    bounds = [nrows * idx // shards for idx in range(shards + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def scan_shard(job: Dict[str, any]) -> Dict[str, any]:
+    """Run the block scan on one shard in a worker process, see find_data_blocks_sharded()"""
+    extractor = job['extractor'](job['input_file'], layout=job['layout'])
+    extractor.PREDICT_STRIDE = job['predict']
+    extractor.snapshot = SheetSnapshot(job['columns'], job['nrows'], job['ncols'])
+    extractor._read_block = extractor.plan.bind(extractor.snapshot)
+    extractor.find_data_blocks()
+    
+    offset = job['offset']
+    metrics = extractor.progress.metrics
+    return {
+        'blocks': [row + offset for row in extractor.data_blocks],
+        'records': extractor.records,
+        'counters': {name: getattr(metrics, name) for name in metrics.SCAN_COUNTERS},
+        'error': extractor.progress.error_message,
+    }
+
+
+def extract_file(input_file: str, decl_type: DeclarationType,
+                 output_file: Optional[str] = None, return_records: bool = False,
+                 output_format: Optional[str] = None, use_cache: bool = False,
+                 profile_file: Optional[str] = None, layout: Optional[LayoutSpec] = None,
+                 shard_workers: int = 1, pipelined: bool = False) -> Dict[str, any]:
+    """Extract one declaration file, for use from worker processes
+    
+    Args:
+        input_file: Path to the .xls/.xlsx declaration
+        decl_type: Export or import declaration (ignored with layout)
+        output_file: Write the output here, if given
+        return_records: Include the extracted line items in the result
+        output_format: Output sink format, see get_output_sink()
+        use_cache: Reuse and store results in the default ExtractionCache
+        profile_file: Run in profile mode and save the cProfile data here
+        layout: Extract with this spec instead of the built-in layout of decl_type
+        shard_workers: Processes for the block scan of a very large sheet
+        pipelined: With output_file, read, extract and write at the same time
+    
+    Returns:
+        Summary dict with input_file, output_file, success, error, items,
+        blocks, seconds and (if requested) records, a ResultSet
+    """
+    start = time.perf_counter()
+    cache = None
+    if use_cache:
+        from extraction_cache import ExtractionCache
+        cache = ExtractionCache()
+    if layout is not None:
+        extractor = SpecExtractor(input_file, layout, cache=cache, profile=bool(profile_file),
+                                  shard_workers=shard_workers, pipelined=pipelined)
+    else:
+        extractor = EXTRACTORS[decl_type](input_file, cache=cache, profile=bool(profile_file),
+                                          shard_workers=shard_workers, pipelined=pipelined)
+    
+    if output_file:
+        success = extractor.run(output_file, output_format)
+    else:
+        success = extractor.extract()
+    
+    stats = extractor.get_stats()
+    result = {
+        'input_file': input_file,
+        'output_file': output_file if success else None,
+        'success': success,
+        'error': extractor.progress.error_message,
+        'items': stats['items'],
+        'blocks': stats['blocks'],
+        'seconds': time.perf_counter() - start,
+        'from_cache': extractor.from_cache,
+        'metrics': extractor.progress.metrics.to_dict(),
+    }
+    if profile_file:
+        extractor.save_profile(profile_file)
+    if return_records:
+        result['records'] = extractor.records if success else ResultSet()
+    return result
@@ -0,0 +1,286 @@
+"""
+Customs Extractor V2 - Resident worker daemon
+Keeps a pool of worker processes with the extractors and Excel libraries
+already imported, and accepts jobs over a local Unix socket (named pipe on
+Windows), so repeated runs only pay the parse time of each file
+
+Examples:
+    python extractor_daemon.py serve -j 2
+    python extractor_daemon.py extract "D:/ToKhai/TKN 12.xlsx" -o "D:/Out/TKN 12.xlsx"
+    python extractor_daemon.py stop
+"""
+
+import argparse
+import os
+import secrets
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+STATE_DIR = Path.home() / ".customs_extractor"
+KEY_FILE = STATE_DIR / "worker.key"
+
+if sys.platform == 'win32':
+    DEFAULT_ADDRESS = r'\\.\pipe\customs_extractor_worker'
+else:
+    DEFAULT_ADDRESS = str(STATE_DIR / "worker.sock")
+
+
+def load_authkey(create: bool = False) -> bytes:
+    """Shared secret of the daemon, only readable by the current user"""
+    if create and not KEY_FILE.exists():
+        STATE_DIR.mkdir(parents=True, exist_ok=True)
+        fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    return KEY_FILE.read_text().strip().encode('ascii')
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one extraction job inside a pool worker"""
+    from extractor_core_v2 import DeclarationType, detect_declaration_types, extract_file
+
+    input_file = job['input_file']
+    decl_type = job.get('decl_type') or 'auto'
+    if decl_type == 'auto':
+        try:
+            detected = detect_declaration_types(input_file)
+        except Exception as e:
+            return {'input_file': input_file, 'success': False, 'error': f"Lỗi khi mở file: {e}"}
+        if len(detected) != 1:
+            error = "Không có sheet TKX hoặc TKN" if not detected else \
+                "File có cả TKX và TKN, hãy chỉ định --type"
+            return {'input_file': input_file, 'success': False, 'error': error}
+        decl_type = detected[0]
+    else:
+        decl_type = DeclarationType(decl_type)
+
+    result = extract_file(
+        input_file, decl_type,
+        output_file=job.get('output_file'),
+        return_records=job.get('return_records', False),
+        output_format=job.get('output_format'),
+        use_cache=job.get('use_cache', True),
+    )
+    result['decl_type'] = decl_type.value
+    result['worker_pid'] = os.getpid()
+    return result
+
+
+def init_worker():
+    """Pool initializer: import everything a job needs before the first one arrives"""
+    import extractor_core_v2
+    import extraction_cache  # noqa: F401
+    extractor_core_v2.warm_up()
+
+
+class WorkerDaemon:
+    """Accept jobs over a local socket and run them on a warm process pool
+
+    Every client connection is served on its own thread; a connection can
+    send any number of requests, each a dict with a 'cmd' key:
+
+        {'cmd': 'extract', 'input_file': ..., 'decl_type': 'auto', ...}
+        {'cmd': 'ping'}
+        {'cmd': 'shutdown'}
+
+    and receives one reply dict per request.
+    """
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, workers: int = 0):
+        self.address = address
+        self.workers = workers or os.cpu_count() or 1
+        self.authkey = load_authkey(create=True)
+        self.executor = None
+        self.listener = None
+        self.started = time.time()
+        self.jobs_done = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _remove_stale_socket(self):
+        """Remove the socket file of a daemon that did not shut down cleanly"""
+        if sys.platform == 'win32' or not os.path.exists(self.address):
+            return
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(self.address)
+            return
+        raise RuntimeError(f"Tiến trình nền đã chạy tại {self.address}")
+
+    def serve_forever(self):
+        """Start the pool and serve until a shutdown request"""
+        from concurrent.futures import ProcessPoolExecutor
+
+        self._remove_stale_socket()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        # Start every worker now instead of on the first jobs
+        for future in [self.executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+        self.listener = Listener(self.address, authkey=self.authkey)
+        print(f"✓ Sẵn sàng tại {self.address} với {self.workers} tiến trình", flush=True)
+        try:
+            while not self._stopping.is_set():
+                try:
+                    conn = self.listener.accept()
+                except Exception as e:
+                    # Failed handshake (wrong key, client gone): keep serving
+                    if not self._stopping.is_set():
+                        print(f"Kết nối bị từ chối: {e}", flush=True)
+                    continue
+                if self._stopping.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            self.listener.close()
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            print("✓ Đã dừng", flush=True)
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                reply = self._handle(request)
+                try:
+                    conn.send(reply)
+                except OSError:
+                    return
+                if request.get('cmd') == 'shutdown':
+                    return
+
+    def _handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        cmd = request.get('cmd')
+        if cmd == 'extract':
+            start = time.perf_counter()
+            try:
+                result = self.executor.submit(run_job, request).result()
+            except Exception as e:
+                result = {'input_file': request.get('input_file'), 'success': False, 'error': str(e)}
+            result['total_seconds'] = time.perf_counter() - start
+            with self._lock:
+                self.jobs_done += 1
+            return result
+        if cmd == 'ping':
+            return {'ok': True, 'pid': os.getpid(), 'workers': self.workers,
+                    'uptime': time.time() - self.started, 'jobs_done': self.jobs_done}
+        if cmd == 'shutdown':
+            self.stop()
+            return {'ok': True}
+        return {'ok': False, 'error': f"Lệnh không hỗ trợ: {cmd}"}
+
+    def stop(self):
+        """Stop accepting connections; the serve loop exits after waking up"""
+        self._stopping.set()
+        # accept() does not return on close from another thread: wake it up
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+
+
+# ---------------------------------------------------------------------------
+# Client side
+# ---------------------------------------------------------------------------
+
+def send_request(request: Dict[str, Any], address: str = DEFAULT_ADDRESS) -> Dict[str, Any]:
+    """Send one request to the daemon and wait for its reply
+
+    Raises:
+        ConnectionError / FileNotFoundError if no daemon is running
+    """
+    with Client(address, authkey=load_authkey()) as conn:
+        conn.send(request)
+        return conn.recv()
+
+
+def submit(input_file: str, decl_type: str = 'auto', output_file: Optional[str] = None,
+           output_format: Optional[str] = None, return_records: bool = False,
+           use_cache: bool = True, address: str = DEFAULT_ADDRESS) -> Dict[str, Any]:
+    """Extract one file on the daemon; same result dict as extract_file()"""
+    return send_request({
+        'cmd': 'extract',
+        # The daemon may run from another working directory
+        'input_file': os.path.abspath(input_file),
+        'decl_type': decl_type,
+        'output_file': os.path.abspath(output_file) if output_file else None,
+        'output_format': output_format,
+        'return_records': return_records,
+        'use_cache': use_cache,
+    }, address)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Tiến trình nền trích xuất tờ khai TKX/TKN")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS,
+                        help="Unix socket hoặc named pipe (mặc định: %(default)s)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="Chạy tiến trình nền")
+    serve.add_argument("-j", "--workers", type=int, default=0,
+                       help="Số tiến trình xử lý (mặc định: số lõi CPU)")
+
+    extract = subparsers.add_parser("extract", help="Gửi một file cho tiến trình nền")
+    extract.add_argument("input", help="File .xls/.xlsx")
+    extract.add_argument("--type", default="auto", choices=["export", "import", "auto"])
+    extract.add_argument("-o", "--output", default="",
+                         help="File kết quả (mặc định: '<tên file> - DS hàng.xlsx' cạnh file gốc)")
+    extract.add_argument("-f", "--format", default=None, choices=["xlsx", "csv", "jsonl", "parquet"])
+    extract.add_argument("--no-cache", action="store_true")
+
+    subparsers.add_parser("ping", help="Kiểm tra tiến trình nền")
+    subparsers.add_parser("stop", help="Dừng tiến trình nền")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        try:
+            WorkerDaemon(args.address, args.workers).serve_forever()
+        except RuntimeError as e:
+            print(f"Lỗi: {e}")
+            return 1
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    try:
+        if args.command == "extract":
+            output = args.output or os.path.join(
+                os.path.dirname(os.path.abspath(args.input)),
+                f"{Path(args.input).stem} - DS hàng.{args.format or 'xlsx'}"
+            )
+            result = submit(args.input, args.type, output, args.format, use_cache=not args.no_cache,
+                            address=args.address)
+            if not result['success']:
+                print(f"✗ {result['error']}")
+                return 1
+            cached = " [cache]" if result.get('from_cache') else ""
+            print(f"✓ {result['output_file']}: {result['items']} dòng hàng "
+                  f"({result['seconds']:.2f}s xử lý, {result['total_seconds']:.2f}s tổng){cached}")
+        elif args.command == "ping":
+            info = send_request({'cmd': 'ping'}, args.address)
+            print(f"✓ PID {info['pid']}, {info['workers']} tiến trình, "
+                  f"{info['jobs_done']} file đã xử lý, chạy {info['uptime']:.0f}s")
+        else:
+            send_request({'cmd': 'shutdown'}, args.address)
+            print("✓ Đã gửi lệnh dừng")
+    except (ConnectionError, FileNotFoundError):
+        print("Tiến trình nền chưa chạy: python extractor_daemon.py serve")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+Customs Extractor V2 - HTTP extraction service
+Accepts an uploaded TKX/TKN workbook and returns its line items as JSON,
+CSV, JSON Lines or xlsx. Extractions run on a bounded process pool; when
+the queue is full, requests are refused with 503 instead of piling up
+
+Examples:
+    python extractor_server.py --host 0.0.0.0 --port 8765 -j 2
+    curl --data-binary @"TKN 12.xlsx" "http://localhost:8765/extract?filename=TKN%2012.xlsx"
+    curl -F "file=@TKN 12.xls" "http://localhost:8765/extract?format=xlsx" -o "DS hang.xlsx"
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from extractor_daemon import init_worker, run_job
+
+
+# Response formats: (output format passed to the core, content type)
+RESPONSE_FORMATS = {
+    'json': (None, 'application/json; charset=utf-8'),
+    'jsonl': ('jsonl', 'application/x-ndjson; charset=utf-8'),
+    'csv': ('csv', 'text/csv; charset=utf-8'),
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+UPLOAD_TYPES = {
+    'application/vnd.ms-excel': '.xls',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
+}
+
+DEFAULT_MAX_UPLOAD_MB = 50
+
+
+def remove_file(path: Optional[str]):
+    """Delete a temp file, ignoring one already gone or still open elsewhere (Windows)"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def render_job(job: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+    """Extract an uploaded file in a pool worker and render the response body"""
+    output_format = RESPONSE_FORMATS[job['format']][0]
+    output_file = None
+    if output_format:
+        fd, output_file = tempfile.mkstemp(suffix=f".{output_format}")
+        os.close(fd)
+
+    try:
+        result = run_job({
+            'input_file': job['input_file'],
+            'decl_type': job['decl_type'],
+            'output_file': output_file,
+            'output_format': output_format,
+            'return_records': output_format is None,
+            'use_cache': job['use_cache'],
+        })
+        if not result['success']:
+            return result, b''
+        if output_file:
+            body = Path(output_file).read_bytes()
+        else:
+            body = json.dumps({
+                'decl_type': result['decl_type'],
+                'items': result.pop('records').to_dicts(),
+            }, ensure_ascii=False).encode('utf-8')
+        return result, body
+    finally:
+        remove_file(output_file)
+
+
+class ExtractionService:
+    """Bounded process pool shared by all request threads
+
+    At most workers + queue_limit extractions are accepted at once; further
+    requests are refused right away so that a burst cannot queue unbounded
+    uploads in memory and on disk.
+    """
+
+    def __init__(self, workers: int = 0, queue_limit: int = 8, timeout: float = 120.0,
+                 max_upload_mb: float = DEFAULT_MAX_UPLOAD_MB, use_cache: bool = True):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.max_upload_bytes = int(max_upload_mb * 1024 * 1024)
+        self.use_cache = use_cache
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        # Start every worker now so the first requests do not pay for it
+        for future in [self.executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+        self._slots = threading.BoundedSemaphore(self.workers + queue_limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        """Reserve a place in the queue, False if it is full"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def finish_job(self, input_file: Optional[str]):
+        """Free the place of a request and its upload once its job has really ended
+
+        A request that times out returns before its job does; the job keeps
+        running in a worker and must still count against the bound, so then
+        this runs from the job's done callback.
+        """
+        remove_file(input_file)
+        self.release()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'in_flight': self.in_flight,
+                'queued': max(0, self.in_flight - self.workers),
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ExtractionHandler(BaseHTTPRequestHandler):
+    """POST /extract with a workbook upload; GET /health for pool status"""
+
+    server_version = "CustomsExtractor/2"
+    service: ExtractionService = None
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._send_json(200, {'ok': True, **self.service.status()})
+        else:
+            self._send_json(404, {'error': "Không tìm thấy"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/extract':
+            self._send_json(404, {'error': "Không tìm thấy"})
+            return
+
+        start = time.perf_counter()
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        response_format = params.get('format', 'json')
+        decl_type = params.get('type', 'auto')
+        if response_format not in RESPONSE_FORMATS:
+            self._send_json(400, {'error': f"Định dạng không hỗ trợ: {response_format}"})
+            return
+        if decl_type not in ('auto', 'export', 'import'):
+            self._send_json(400, {'error': f"Loại tờ khai không hợp lệ: {decl_type}"})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0:
+            self._send_json(400, {'error': "Thiếu nội dung file"})
+            return
+        if length > self.service.max_upload_bytes:
+            self._send_json(413, {'error': "File quá lớn"})
+            self.close_connection = True
+            return
+
+        if not self.service.try_acquire():
+            self._send_json(503, {'error': "Máy chủ đang bận, hãy thử lại sau"},
+                            {'Retry-After': '5'})
+            self.close_connection = True
+            return
+
+        input_file = None
+        # Set once the slot and the upload are freed, or left to a timed-out job
+        released = False
+        try:
+            upload, extension = self._read_upload(length, params.get('filename', ''))
+            if extension not in ('.xls', '.xlsx'):
+                self._send_json(415, {'error': "Chỉ nhận file .xls hoặc .xlsx"})
+                return
+
+            fd, input_file = tempfile.mkstemp(suffix=extension)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(upload)
+            del upload
+
+            submitted = time.perf_counter()
+            future = self.service.executor.submit(render_job, {
+                'input_file': input_file,
+                'decl_type': decl_type,
+                'format': response_format,
+                'use_cache': self.service.use_cache,
+            })
+            try:
+                result, body = future.result(timeout=self.service.timeout)
+            except FutureTimeout:
+                # Only a queued job can be cancelled; a running one keeps its
+                # slot and upload until it ends
+                future.cancel()
+                future.add_done_callback(lambda _, path=input_file: self.service.finish_job(path))
+                released = True
+                self._send_json(504, {'error': "Quá thời gian xử lý"})
+                return
+            # Free the slot before answering, so that the client's next
+            # request finds it available
+            self.service.finish_job(input_file)
+            released = True
+
+            total = time.perf_counter() - start
+            extract_seconds = result.get('seconds', 0.0)
+            queue_seconds = max(0.0, time.perf_counter() - submitted - extract_seconds)
+            timing = {
+                'X-Extract-Seconds': f"{extract_seconds:.4f}",
+                'X-Queue-Seconds': f"{queue_seconds:.4f}",
+                'X-Total-Seconds': f"{total:.4f}",
+                'Server-Timing': (f"queue;dur={queue_seconds * 1000:.1f}, "
+                                  f"extract;dur={extract_seconds * 1000:.1f}, "
+                                  f"total;dur={total * 1000:.1f}"),
+            }
+            if not result['success']:
+                self._send_json(422, {'error': result['error']}, timing)
+                return
+
+            timing['X-Items'] = str(result['items'])
+            timing['X-Declaration-Type'] = result['decl_type']
+            if result.get('from_cache'):
+                timing['X-Cache'] = 'hit'
+            self._send(200, body, RESPONSE_FORMATS[response_format][1], timing)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+        finally:
+            if not released:
+                self.service.finish_job(input_file)
+
+    def _read_upload(self, length: int, filename: str) -> Tuple[bytes, str]:
+        """Body bytes and file extension of a raw or multipart/form-data upload"""
+        body = self.rfile.read(length)
+        content_type = self.headers.get('Content-Type', '')
+
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=email_policy).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+            )
+            for part in message.iter_parts():
+                if part.get_filename():
+                    body = part.get_payload(decode=True)
+                    filename = filename or part.get_filename()
+                    content_type = part.get_content_type()
+                    break
+            else:
+                return b'', ''
+
+        extension = Path(filename).suffix.lower() if filename else ''
+        if not extension:
+            extension = UPLOAD_TYPES.get(content_type.split(';')[0].strip(), '')
+        return body, extension
+
+    def _send(self, status: int, body: bytes, content_type: str,
+              headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self._send(status, body, 'application/json; charset=utf-8', headers)
+
+
+def create_server(host: str = "127.0.0.1", port: int = 8765, **service_options) -> ThreadingHTTPServer:
+    """HTTP server bound to host:port with its own ExtractionService (port 0: any free port)"""
+    service = ExtractionService(**service_options)
+    handler = type('BoundExtractionHandler', (ExtractionHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Dịch vụ HTTP trích xuất tờ khai TKX/TKN")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Địa chỉ lắng nghe (0.0.0.0 để mở cho mạng LAN)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("-j", "--workers", type=int, default=0,
+                        help="Số tiến trình xử lý (mặc định: số lõi CPU)")
+    parser.add_argument("--queue", type=int, default=8,
+                        help="Số yêu cầu tối đa được xếp hàng chờ, vượt quá trả về 503")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Giây tối đa cho mỗi file")
+    parser.add_argument("--max-upload-mb", type=float, default=DEFAULT_MAX_UPLOAD_MB)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    server = create_server(
+        args.host, args.port, workers=args.workers, queue_limit=args.queue,
+        timeout=args.timeout, max_upload_mb=args.max_upload_mb, use_cache=not args.no_cache,
+    )
+    host, port = server.server_address[:2]
+    print(f"✓ Đang phục vụ tại http://{host}:{port} "
+          f"({server.service.workers} tiến trình, hàng chờ {args.queue})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
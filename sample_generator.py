@@ -0,0 +1,193 @@
+"""
+Synthetic TKX/TKN declaration generator
+Builds .xls/.xlsx files following the block layout specs of the
+extractors, for benchmarks and regression checks
+
+Example:
+    python sample_generator.py --type import --blocks 5000 tkn_5000.xlsx
+"""
+
+import argparse
+import random
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from extractor_core_v2 import DeclarationType, EXTRACTORS, OUTPUT_COLUMNS, LayoutSpec
+
+
+# Sheet row limits per format
+MAX_ROWS = {'.xls': 65536, '.xlsx': 1048576}
+
+# Rows per item page in real declarations (one item per printed page)
+DEFAULT_PAGE_ROWS = {DeclarationType.EXPORT: 40, DeclarationType.IMPORT: 53}
+
+# Rows of declaration header before the first item page
+HEADER_ROWS = 20
+
+# Row of the block label within an item page
+LABEL_ROW_IN_PAGE = 9
+
+COUNTRIES = ["CN", "VN", "JP", "KR", "US", "DE", "TH", "TW"]
+UNITS = ["PCE", "KGM", "SET", "MTR", "UNK"]
+PRODUCTS = [
+    "Thanh trượt gắn con lăn, khung bằng thép",
+    "Cảm biến quang điện PM-T45, điện áp 24V",
+    "Giá đỡ góc bằng thép không gỉ, kích thước 200*100*20MM",
+    "Ổ cắm điện 3 lỗ cắm, điện áp 220V- 10A",
+    "Bộ phận băng tải đã lắp ráp, dùng trong nhà xưởng",
+]
+
+
+def format_vn_number(value: float, decimals: int = 2) -> str:
+    """Format a number the way customs exports do: 1.234.567,89"""
+    text = f"{value:,.{decimals}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text.replace(',', ' ').replace('.', ',').replace(' ', '.')
+
+
+# Labels written next to the fields, as in real declarations
+FIELD_LABELS = dict(OUTPUT_COLUMNS)
+
+
+def get_min_page_rows(layout: LayoutSpec) -> int:
+    """Smallest page that still holds one block"""
+    return LABEL_ROW_IN_PAGE + layout.block_span + 1
+
+
+def build_item_cells(layout: LayoutSpec, index: int, rng: random.Random) -> Dict[Tuple[int, int], object]:
+    """Cells of one item block as {(row offset from label, 0-based column): value}"""
+    hs_code = str(rng.randint(10000000, 99999999))
+    qty1 = rng.randint(1, 5000)
+    qty2 = round(qty1 * rng.uniform(0.1, 3), 3)
+    unit_price = round(rng.uniform(0.1, 500), 2)
+    invoice_value = round(qty1 * unit_price, 2)
+    unit1 = rng.choice(UNITS)
+    unit2 = rng.choice(UNITS)
+    origin = rng.choice(COUNTRIES)
+    description = f"{rng.choice(PRODUCTS)}, mã hàng {index + 1}. Hàng mới 100%"
+
+    values = {
+        'hs_code': hs_code,
+        'description': description,
+        'origin': origin,
+        'qty1': format_vn_number(qty1),
+        'unit1': unit1,
+        'qty2': format_vn_number(qty2, 3),
+        'unit2': unit2,
+        'invoice_value': format_vn_number(invoice_value),
+        'unit_price': format_vn_number(unit_price),
+    }
+    if layout.origin_suffix:
+        values[layout.origin_suffix] = f"{values[layout.origin_suffix]}#&{origin}"
+
+    cells = {(field.offset, field.column): values[field.name] for field in layout.fields}
+
+    # Labels around the values, as in real declarations
+    cells[(-1, layout.label_column)] = f"<{index + 1:02d}>"
+    cells[(0, layout.label_column)] = layout.block_label
+    for field in layout.fields:
+        if field.offset > 0:
+            cells.setdefault((field.offset, layout.label_column), FIELD_LABELS[field.name])
+    return cells
+
+
+def iter_declaration_rows(decl_type: DeclarationType, num_blocks: int, page_rows: int, seed: int):
+    """Yield every row of the declaration sheet as a list of values"""
+    rng = random.Random(seed)
+    layout = EXTRACTORS[decl_type].LAYOUT
+    label_column = layout.label_column
+    width = max(layout.columns) + 2
+    title = "Tờ khai hàng hóa xuất khẩu (thông quan)" if decl_type == DeclarationType.EXPORT \
+        else "Tờ khai hàng hóa nhập khẩu (thông quan)"
+
+    for row in range(HEADER_ROWS):
+        values = [None] * width
+        if row == 1:
+            values[label_column + 1] = title
+        elif row == 4:
+            values[label_column] = "Số tờ khai"
+            values[label_column + 2] = 107762119250
+        yield values
+
+    for index in range(num_blocks):
+        page = [[None] * width for _ in range(page_rows)]
+        page[0][label_column + 1] = title
+        for (offset, col), value in build_item_cells(layout, index, rng).items():
+            page[LABEL_ROW_IN_PAGE + offset][col] = value
+        yield from page
+
+
+def generate_declaration(output_file: str, decl_type: DeclarationType, num_blocks: int,
+                         page_rows: int = 0, seed: int = 0):
+    """Write a synthetic declaration with num_blocks line items
+
+    Args:
+        output_file: .xls or .xlsx path; the extension selects the format
+        decl_type: Export (TKX sheet) or import (TKN sheet)
+        num_blocks: Number of line items
+        page_rows: Rows per item page (default: as in real declarations)
+        seed: Random seed, the same seed gives the same file
+    """
+    ext = Path(output_file).suffix.lower()
+    if ext not in MAX_ROWS:
+        raise ValueError(f"Định dạng không hỗ trợ: {ext}")
+
+    page_rows = page_rows or DEFAULT_PAGE_ROWS[decl_type]
+    layout = EXTRACTORS[decl_type].LAYOUT
+    min_rows = get_min_page_rows(layout)
+    if page_rows < min_rows:
+        raise ValueError(f"page_rows phải >= {min_rows}")
+
+    total_rows = HEADER_ROWS + num_blocks * page_rows
+    if total_rows > MAX_ROWS[ext]:
+        raise ValueError(
+            f"{num_blocks} khối x {page_rows} hàng vượt quá giới hạn {MAX_ROWS[ext]} hàng của {ext}"
+        )
+
+    sheet_name = layout.sheet_name
+    rows = iter_declaration_rows(decl_type, num_blocks, page_rows, seed)
+
+    if ext == '.xls':
+        try:
+            import xlwt
+        except ImportError:
+            raise ImportError("Cần cài xlwt để tạo file .xls: pip install xlwt")
+        wb = xlwt.Workbook(encoding='utf-8')
+        ws = wb.add_sheet(sheet_name)
+        for row_idx, values in enumerate(rows):
+            for col_idx, value in enumerate(values):
+                if value is not None:
+                    ws.write(row_idx, col_idx, value)
+        wb.save(output_file)
+    else:
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(sheet_name)
+        for values in rows:
+            ws.append(values)
+        wb.save(output_file)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Tạo tờ khai TKX/TKN giả lập để đo hiệu năng")
+    parser.add_argument("output", help="File .xls hoặc .xlsx cần tạo")
+    parser.add_argument("--type", required=True, choices=[t.value for t in DeclarationType])
+    parser.add_argument("--blocks", type=int, default=1000, help="Số dòng hàng")
+    parser.add_argument("--page-rows", type=int, default=0,
+                        help="Số hàng mỗi trang dòng hàng (mặc định như tờ khai thật)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    try:
+        generate_declaration(args.output, DeclarationType(args.type), args.blocks, args.page_rows, args.seed)
+    except (ValueError, ImportError) as e:
+        print(f"Lỗi: {e}")
+        return 1
+    print(f"✓ Đã tạo {args.output} ({args.blocks} dòng hàng)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
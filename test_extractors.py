@@ -0,0 +1,207 @@
+"""
+Tests for the extractor core on generated TKX/TKN declarations
+Every speed-up must give the same blocks and line items as the plain path:
+stride prediction, the raw .xlsx reader, the sharded scan and the pipelined
+run are checked against it. Layout specs must reject what they cannot read,
+the cache must survive a damaged entry and a cancelled run must leave no
+partial output.
+Run from the project directory:
+    python -m pytest -q
+"""
+
+import copy
+import csv
+import gzip
+import os
+
+import pytest
+
+from extraction_cache import ExtractionCache
+from extractor_core_v2 import DeclarationType, EXTRACTORS, IMPORT_LAYOUT, ImportExtractor, LayoutSpec, OUTPUT_SINKS
+from sample_generator import generate_declaration
+
+
+DECLARATIONS = [
+    (decl_type, ext)
+    for decl_type in (DeclarationType.EXPORT, DeclarationType.IMPORT)
+    for ext in ('.xls', '.xlsx')
+]
+
+
+@pytest.fixture(scope="module", params=DECLARATIONS, ids=lambda case: f"{case[0].value}{case[1]}")
+def declaration(request, tmp_path_factory):
+    """(extractor class, path) of a generated declaration"""
+    decl_type, ext = request.param
+    path = str(tmp_path_factory.mktemp("data") / f"{decl_type.value}{ext}")
+    generate_declaration(path, decl_type, 60, seed=1)
+    return EXTRACTORS[decl_type], path
+
+
+def scan(cls, input_file: str, **attributes):
+    """Extractor after load_workbook() and find_data_blocks(), with class attributes overridden"""
+    extractor = cls(input_file)
+    for name, value in attributes.items():
+        setattr(extractor, name, value)
+    assert extractor.load_workbook(), extractor.progress.error_message
+    assert extractor.find_data_blocks(), extractor.progress.error_message
+    return extractor
+
+
+def read_csv(path: str) -> list:
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_stride_prediction(declaration):
+    cls, path = declaration
+    predicted = scan(cls, path, PREDICT_STRIDE=True)
+    scanned = scan(cls, path, PREDICT_STRIDE=False)
+    assert predicted.progress.metrics.blocks_predicted > 0
+    assert predicted.data_blocks == scanned.data_blocks
+    assert predicted.records == scanned.records
+
+
+def test_raw_xlsx_reader(declaration):
+    cls, path = declaration
+    if not path.endswith('.xlsx'):
+        pytest.skip("raw reader reads .xlsx only")
+    raw = scan(cls, path, RAW_XLSX=True)
+    openpyxl = scan(cls, path, RAW_XLSX=False)
+    assert raw.snapshot.nrows == openpyxl.snapshot.nrows
+    assert raw.snapshot.columns == openpyxl.snapshot.columns
+    assert raw.data_blocks == openpyxl.data_blocks
+    assert raw.records == openpyxl.records
+
+
+def test_sharded_scan(declaration):
+    cls, path = declaration
+    extractor = scan(cls, path)
+    blocks, records = list(extractor.data_blocks), extractor.records
+    for shards in (2, 7):
+        assert extractor.find_data_blocks_sharded(2, shards), extractor.progress.error_message
+        assert extractor.data_blocks == blocks
+        assert extractor.records == records
+
+
+def test_pipelined_run(declaration, tmp_path):
+    cls, path = declaration
+    serial, pipelined = cls(path), cls(path, pipelined=True)
+    assert serial.run(str(tmp_path / "serial.csv"), 'csv'), serial.progress.error_message
+    assert pipelined.run(str(tmp_path / "pipelined.csv"), 'csv'), pipelined.progress.error_message
+    assert pipelined.data_blocks == serial.data_blocks
+    assert pipelined.records == serial.records
+    assert read_csv(str(tmp_path / "pipelined.csv")) == read_csv(str(tmp_path / "serial.csv"))
+
+
+def layout_dict(**changes) -> dict:
+    data = copy.deepcopy(IMPORT_LAYOUT.to_dict())
+    data.update(changes)
+    return data
+
+
+def test_layout_round_trip():
+    assert LayoutSpec.from_dict(IMPORT_LAYOUT.to_dict()) == IMPORT_LAYOUT
+    assert LayoutSpec.from_dict(layout_dict(label_column=0)).label_column == 0
+
+
+@pytest.mark.parametrize("data", [
+    layout_dict(label_column=-1),
+    layout_dict(label_column="A1"),
+    layout_dict(label_column=None),
+    layout_dict(fields={**IMPORT_LAYOUT.to_dict()['fields'], 'qty1': {'column': -1, 'type': 'number'}}),
+    layout_dict(fields={**IMPORT_LAYOUT.to_dict()['fields'], 'qty1': {'column': 'G', 'offset': 'x', 'type': 'number'}}),
+    layout_dict(fields={**IMPORT_LAYOUT.to_dict()['fields'], 'qty1': {'column': 'G', 'type': 'text'}}),
+    layout_dict(fields={**IMPORT_LAYOUT.to_dict()['fields'], 'weight': {'column': 'G'}}),
+    layout_dict(fields=[]),
+    layout_dict(fields=None),
+    layout_dict(block_label=""),
+    {'name': "TKN"},
+    [],
+], ids=[
+    "negative-label-column", "bad-letters", "null-column", "negative-field-column", "bad-offset",
+    "wrong-type", "unknown-field", "fields-list", "fields-null", "empty-label", "missing-keys", "not-a-dict",
+])
+def test_layout_rejects_bad_specs(data):
+    with pytest.raises(ValueError):
+        LayoutSpec.from_dict(data)
+
+
+def test_layout_validate_rejects_negative_columns():
+    with pytest.raises(ValueError):
+        IMPORT_LAYOUT._replace(label_column=-1).validate()
+    fields = tuple(field._replace(column=-1) if field.name == 'qty1' else field
+                   for field in IMPORT_LAYOUT.fields)
+    with pytest.raises(ValueError):
+        IMPORT_LAYOUT._replace(fields=fields).validate()
+
+
+@pytest.fixture(scope="module")
+def import_file(tmp_path_factory) -> str:
+    path = str(tmp_path_factory.mktemp("data") / "TKN.xlsx")
+    generate_declaration(path, DeclarationType.IMPORT, 200, seed=2)
+    return path
+
+
+def test_cache_hit(import_file, tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache"))
+    first = ImportExtractor(import_file, cache=cache)
+    assert first.extract(), first.progress.error_message
+    second = ImportExtractor(import_file, cache=cache)
+    assert second.extract(), second.progress.error_message
+    assert not first.from_cache and second.from_cache
+    assert second.data_blocks == first.data_blocks
+    assert second.records == first.records
+
+
+def test_corrupted_cache_entry_is_rebuilt(import_file, tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache"))
+    first = ImportExtractor(import_file, cache=cache)
+    assert first.extract(), first.progress.error_message
+    entries = list(cache.cache_dir.glob('*.json.gz'))
+    assert len(entries) == 1
+    
+    # A truncated entry, then one that is not gzip at all
+    for damage in (entries[0].read_bytes()[:20], b"not gzip"):
+        entries[0].write_bytes(damage)
+        again = ImportExtractor(import_file, cache=cache)
+        assert again.extract(), again.progress.error_message
+        assert not again.from_cache
+        assert again.records == first.records
+        with gzip.open(entries[0], 'rt', encoding='utf-8') as f:
+            assert f.read()
+
+
+def test_cache_key_follows_content_and_eviction(import_file, tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache"), max_size_mb=0)
+    key = cache.make_key(import_file, "TKN", 1)
+    assert key == cache.make_key(import_file, "TKN", 1)
+    assert key != cache.make_key(import_file, "TKN", 2)
+    
+    changed = tmp_path / "changed.xlsx"
+    changed.write_bytes(open(import_file, 'rb').read() + b"\0")
+    assert cache.make_key(str(changed), "TKN", 1) != key
+    
+    # Over the size limit every entry is evicted once written
+    cache.put(key, ['hs_code'], {'hs_code': ["12345678"]}, [0])
+    assert cache.get(key) is None
+
+
+@pytest.mark.parametrize("output_format", ['xlsx', 'csv', 'jsonl'])
+@pytest.mark.parametrize("pipelined", [False, True], ids=["serial", "pipelined"])
+def test_cancelled_run_removes_partial_output(import_file, tmp_path, monkeypatch, output_format, pipelined):
+    output_file = str(tmp_path / f"out.{output_format}")
+    extractor = ImportExtractor(import_file, pipelined=pipelined)
+    # Several batches, so the writer checks the token again after the first
+    extractor.PIPELINE_BATCH = 16
+    sink_class = OUTPUT_SINKS[output_format]
+    write_row = sink_class.write_row
+    
+    def write_and_cancel(sink, values):
+        # Cancel once the first row is written
+        write_row(sink, values)
+        extractor.cancel()
+    
+    monkeypatch.setattr(sink_class, 'write_row', write_and_cancel)
+    assert not extractor.run(output_file, output_format)
+    assert extractor.progress.is_cancelled
+    assert not os.path.exists(output_file)
@@ -0,0 +1,102 @@
+"""
+Tests for the HTTP extraction service: status codes and the request bound
+Run from the project directory:
+    python -m pytest -q
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from extractor_core_v2 import DeclarationType
+from extractor_server import create_server
+from sample_generator import generate_declaration
+
+
+@pytest.fixture(scope="module")
+def upload(tmp_path_factory) -> bytes:
+    path = tmp_path_factory.mktemp("data") / "TKN.xlsx"
+    generate_declaration(str(path), DeclarationType.IMPORT, 20, seed=1)
+    return path.read_bytes()
+
+
+def start_server(**options):
+    """Server on a free port with one worker and no queue, unless overridden"""
+    options = {'workers': 1, 'queue_limit': 0, 'use_cache': False, **options}
+    server = create_server("127.0.0.1", 0, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+    server.service.shutdown()
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = start_server()
+    yield server
+    stop_server(server)
+
+
+def request(server, path: str, data: bytes = None):
+    """(status, body) of a GET, or of a POST when data is given"""
+    port = server.server_address[1]
+    req = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=data,
+                                 method='POST' if data is not None else 'GET')
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def test_back_to_back_requests_get_the_freed_slot(server, upload):
+    # One worker and no queue: each request must find the slot of the one before free
+    statuses = [request(server, "/extract?filename=a.xlsx", upload)[0] for _ in range(5)]
+    assert statuses == [200] * 5
+    assert request(server, "/extract?filename=a.txt", upload)[0] == 415
+
+
+def test_json_response(server, upload):
+    status, body = request(server, "/extract?filename=a.xlsx&type=import", upload)
+    assert status == 200
+    data = json.loads(body)
+    assert data['decl_type'] == DeclarationType.IMPORT.value
+    assert len(data['items']) == 20
+
+
+def test_bad_requests(server, upload):
+    assert request(server, "/nowhere")[0] == 404
+    assert request(server, "/extract?format=pdf&filename=a.xlsx", upload)[0] == 400
+    assert request(server, "/extract?type=other&filename=a.xlsx", upload)[0] == 400
+    assert request(server, "/extract?filename=a.xlsx", b"")[0] == 400
+    assert request(server, "/extract?filename=a.xlsx", b"not a workbook")[0] == 422
+
+
+def test_busy_server_refuses(server, upload):
+    assert server.service.try_acquire()
+    try:
+        assert request(server, "/extract?filename=a.xlsx", upload)[0] == 503
+    finally:
+        server.service.release()
+    assert request(server, "/extract?filename=a.xlsx", upload)[0] == 200
+
+
+def test_timed_out_job_keeps_its_slot_until_it_ends(upload):
+    server = start_server(timeout=0.001)
+    try:
+        assert request(server, "/extract?filename=a.xlsx", upload)[0] == 504
+        for _ in range(300):
+            if server.service.status()['in_flight'] == 0:
+                break
+            time.sleep(0.1)
+        assert server.service.status()['in_flight'] == 0
+    finally:
+        stop_server(server)
@@ -0,0 +1,82 @@
+"""
+Tests for the output sinks and the number column conversion
+Run from the project directory:
+    python -m pytest -q
+"""
+
+import csv
+import json
+
+import pytest
+
+from extractor_core_v2 import OUTPUT_COLUMNS, get_output_sink, normalize_numbers, write_output_file
+
+
+RECORDS = [
+    {'description': "Vải dệt kim", 'origin': "VN", 'hs_code': "60063200", 'qty1': 1234567.89,
+     'unit1': "MTR", 'qty2': 12, 'unit2': "KGM", 'unit_price': 2.86, 'invoice_value': 3530864.16},
+    {'description': "Chỉ may", 'origin': "CN", 'hs_code': "52041100", 'qty1': "xem phụ lục",
+     'unit1': "KGM", 'qty2': None, 'unit2': "", 'unit_price': 0.5, 'invoice_value': 100},
+]
+
+
+def test_normalize_numbers():
+    values = [2.86, 3.0, 7, "1.234.567,89", " 12 ", "", "  ", None, "xem phụ lục", "nan", True]
+    assert normalize_numbers(values) == [2.86, 3, 7, 1234567.89, 12, None, None, None, "xem phụ lục", "nan", "True"]
+    assert type(normalize_numbers([3.0])[0]) is int
+
+
+def test_csv_sink(tmp_path):
+    path = str(tmp_path / "out.csv")
+    write_output_file(path, RECORDS, output_format='csv')
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == [header for _, header in OUTPUT_COLUMNS]
+    assert len(rows) == 1 + len(RECORDS)
+    qty1 = [key for key, _ in OUTPUT_COLUMNS].index('qty1')
+    assert rows[2][qty1] == "xem phụ lục"
+
+
+def test_jsonl_sink(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    write_output_file(path, RECORDS, output_format='jsonl')
+    with open(path, encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f]
+    assert rows == [{key: record[key] for key, _ in OUTPUT_COLUMNS} for record in RECORDS]
+
+
+def test_parquet_sink_keeps_text_of_number_cells(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "out.parquet")
+    write_output_file(path, RECORDS, output_format='parquet')
+    table = pq.read_table(path)
+    assert table.num_rows == len(RECORDS)
+    assert table.column('qty1').to_pylist() == [1234567.89, None]
+    assert table.column('qty1_text').to_pylist() == [None, "xem phụ lục"]
+    assert table.column('qty2').to_pylist() == [12.0, None]
+    assert table.column('hs_code').to_pylist() == ["60063200", "52041100"]
+
+
+def test_parquet_sink_row_groups(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "out.parquet")
+    sink = get_output_sink(path, 'parquet')
+    sink.ROW_GROUP_SIZE = 2
+    with sink:
+        for record in RECORDS * 3:
+            sink.write(record)
+    table = pq.read_table(path)
+    assert pq.ParquetFile(path).num_row_groups == 3
+    assert table.column('qty1_text').to_pylist() == [None, "xem phụ lục"] * 3
+
+
+@pytest.mark.parametrize("output_format", ['xlsx', 'csv', 'jsonl', 'parquet'])
+def test_failed_write_leaves_no_file(tmp_path, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip("pyarrow")
+    path = tmp_path / f"out.{output_format}"
+    with pytest.raises(RuntimeError):
+        with get_output_sink(str(path), output_format) as sink:
+            sink.write(RECORDS[0])
+            raise RuntimeError("stop")
+    assert not path.exists()